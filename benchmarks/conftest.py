@@ -0,0 +1,132 @@
+"""Synthetic data and measurement fixtures for benchmarks."""
+
+from functools import lru_cache
+import json
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest  # type: ignore
+import shapely  # type: ignore
+from shapely.geometry import mapping  # type: ignore
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+pytest.importorskip("pytest_benchmark")
+
+KINDS = ["points", "polygons", "multipart"]
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--sizes",
+        default="100",
+        help="Comma-separated numbers of synthetic features (default: 100).",
+    )
+    parser.addoption(
+        "--memory",
+        action="store_true",
+        default=False,
+        help="Record the peak memory allocation of each benchmark. Slow.",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "features" in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption("sizes").split(",")]
+        metafunc.parametrize(
+            "features",
+            [(kind, size) for kind in KINDS for size in sizes],
+            ids=lambda param: "{}-{}".format(*param),
+            indirect=True,
+        )
+
+
+@lru_cache(maxsize=None)
+def make_geometries(kind, count):
+    """Make geometries scattered around (4 43).
+
+    Points have one vertex, polygons about 1000, and multipart
+    geometries are made of 50 polygons of about 20 vertices.
+
+    """
+    rng = np.random.default_rng(0)
+    xy = rng.uniform((3.0, 42.0), (5.0, 44.0), (count, 2))
+    points = shapely.points(xy)
+
+    if kind == "points":
+        return points
+    elif kind == "polygons":
+        return shapely.buffer(points, 0.01, quad_segs=250)
+    elif kind == "multipart":
+        offsets = rng.uniform(-0.1, 0.1, (count, 50, 2))
+        parts = shapely.buffer(shapely.points(xy[:, None, :] + offsets), 0.002, 5)
+        return np.array([shapely.multipolygons(row) for row in parts], dtype=object)
+    else:
+        raise ValueError(kind)
+
+
+@lru_cache(maxsize=None)
+def make_features(kind, count):
+    """Make a tuple of GeoJSON-like feature dicts."""
+    return tuple(
+        {
+            "type": "Feature",
+            "id": str(i),
+            "properties": {"i": i, "name": f"feature {i}", "even": i % 2 == 0},
+            "geometry": mapping(geom),
+        }
+        for i, geom in enumerate(make_geometries(kind, count))
+    )
+
+
+@pytest.fixture
+def features(request):
+    """A list of synthetic features."""
+    return list(make_features(*request.param))
+
+
+@pytest.fixture
+def feature_text(features):
+    """Synthetic features as a newline-delimited GeoJSON sequence."""
+    return "".join(json.dumps(feat) + "\n" for feat in features)
+
+
+@pytest.fixture
+def measure(benchmark, request):
+    """Benchmark a function and record throughput and memory use.
+
+    Features per second and the peak RSS of the process are stored in
+    the benchmark's extra_info. With the --memory option, the function
+    is called once more while tracemalloc records its peak allocation.
+
+    """
+
+    def run(func, *args, count):
+        result = benchmark(func, *args)
+
+        info = benchmark.extra_info
+        info["features"] = count
+
+        if request.config.getoption("memory"):
+            tracemalloc.start()
+            try:
+                func(*args)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            info["peak_alloc_mb"] = round(peak / 2**20, 3)
+
+        if benchmark.stats:
+            info["features_per_sec"] = round(count / benchmark.stats.stats.mean, 1)
+        if resource:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+            scale = 2**20 if sys.platform == "darwin" else 2**10
+            info["max_rss_mb"] = round(rss / scale, 1)
+        return result
+
+    return run
@@ -0,0 +1,26 @@
+"""Benchmarks of the CLI commands, including input and output."""
+
+from click.testing import CliRunner
+from fiona.fio.main import main_group  # type: ignore
+import pytest  # type: ignore
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["map", "centroid g"],
+        ["map", "--batch-size", "100", "buffer g 100"],
+        ["map", "--raw", "area g"],
+        ["filter", "< (distance g (Point 4 43)) 100e3"],
+        ["reduce", "unary_union c"],
+    ],
+    ids=lambda args: " ".join(args),
+)
+def test_command(measure, features, feature_text, args):
+    runner = CliRunner()
+
+    def invoke():
+        result = runner.invoke(main_group, args, input=feature_text)
+        assert result.exit_code == 0
+
+    measure(invoke, count=len(features))
@@ -0,0 +1,95 @@
+"""Benchmarks of the features and snuggs modules."""
+
+import pytest  # type: ignore
+from shapely.geometry import shape  # type: ignore
+
+from fio_planet import snuggs
+from fio_planet.features import (
+    area,
+    buffer,
+    compile_pipeline,
+    distance,
+    length,
+    map_batch,
+    map_feature,
+    map_features,
+    reduce_features,
+    simplify,
+)
+
+PIPELINES = [
+    "centroid g",
+    "area g",
+    "< (distance g (Point 4 43)) 100e3",
+    "intersects g (buffer (Point 4 43) 50e3)",
+    "== (get (get f 'properties') 'even') true",
+]
+
+
+@pytest.mark.parametrize("pipeline", PIPELINES)
+def test_map_feature(measure, features, pipeline):
+    expression = compile_pipeline(pipeline)
+    measure(
+        lambda: [list(map_feature(expression, feat)) for feat in features],
+        count=len(features),
+    )
+
+
+@pytest.mark.parametrize("pipeline", PIPELINES[:4])
+def test_map_batch(measure, features, pipeline):
+    expression = compile_pipeline(pipeline)
+    measure(lambda: map_batch(expression, features), count=len(features))
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_map_features_threads(measure, features, threads):
+    expression = compile_pipeline("buffer g 100")
+    measure(
+        lambda: list(map_features(expression, features, threads=threads)),
+        count=len(features),
+    )
+
+
+@pytest.mark.parametrize(
+    "pipeline",
+    ["unary_union c", "chunked_union c", "total_bounds c", "area (convex_hull_all c)"],
+)
+def test_reduce_features(measure, features, pipeline):
+    expression = compile_pipeline(pipeline)
+    measure(lambda: list(reduce_features(expression, features)), count=len(features))
+
+
+SOURCE = "(if (> (area g) 1e6) (simplify (buffer g (/ (area g) 1e3)) 10) g)"
+
+
+def test_snuggs_compile(benchmark):
+    """Parsing and optimization of a pipeline."""
+    benchmark(compile_pipeline, SOURCE)
+
+
+def test_snuggs_parse(benchmark):
+    """Parsing of a pipeline without optimization."""
+    benchmark(snuggs.compile, SOURCE)
+
+
+def test_snuggs_evaluate(benchmark):
+    """Evaluation of a compiled expression that does not touch geometry."""
+    expression = snuggs.compile("(+ (* x 2) (- y 1))")
+    benchmark(expression, x=1, y=2)
+
+
+@pytest.mark.parametrize(
+    ["func", "args"],
+    [(area, ()), (length, ()), (buffer, (100,)), (simplify, (10,))],
+    ids=["area", "length", "buffer", "simplify"],
+)
+@pytest.mark.parametrize("crs", [None, "auto-utm"])
+def test_projectable_wrappers(measure, features, func, args, crs):
+    geoms = [shape(feat["geometry"]) for feat in features]
+    measure(lambda: [func(geom, *args, crs=crs) for geom in geoms], count=len(features))
+
+
+def test_projectable_distance(measure, features):
+    geoms = [shape(feat["geometry"]) for feat in features]
+    other = shape({"type": "Point", "coordinates": (4, 43)})
+    measure(lambda: [distance(geom, other) for geom in geoms], count=len(features))
@@ -3,15 +3,316 @@
 """Fiona CLI command plugins."""
 
 from collections import defaultdict
-from copy import copy
-import itertools
+from functools import wraps
 import json
 
 import click
 from cligj import use_rs_opt  # type: ignore
-from fiona.fio.helpers import obj_gen  # type: ignore
+import fiona  # type: ignore
+from fiona.model import to_dict  # type: ignore
+from pyproj import CRS  # type: ignore
+from pyproj.exceptions import CRSError  # type: ignore
+
+from .errors import WriteError
+from .features import (
+    AUTO_UTM,
+    compile_pipeline,
+    explain_pipeline,
+    join_features,
+    join_predicates,
+    map_features,
+    read_features,
+    reduce_features,
+    use_projection,
+    zip_feature_properties,
+)
+from .serialize import (
+    DatasetWriter,
+    MappedRecords,
+    WkbWriter,
+    Writer,
+    is_text_sequence,
+    open_records,
+    read_ahead,
+)
+from .stats import collect_stats
+
+jobs_opt = click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes used to evaluate the pipeline.",
+)
+
+threads_opt = click.option(
+    "--threads",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker threads used to evaluate the pipeline. "
+    "Can not be combined with --jobs.",
+)
+
+
+def _parse_projection(ctx, param, value):
+    """Check that a projection is "auto-utm" or a CRS known to pyproj."""
+    if value is None or value == AUTO_UTM:
+        return value
+    try:
+        CRS.from_user_input(value)
+    except CRSError as exc:
+        raise click.BadParameter(str(exc))
+    return value
+
+
+projection_opt = click.option(
+    "--projection",
+    "crs",
+    default=None,
+    callback=_parse_projection,
+    help="Coordinate reference system used by the area, buffer, distance, "
+    "length, simplify, and set_precision functions. The default is EPSG:6933. "
+    "'auto-utm' selects the UTM zone of each geometry.",
+)
+
+batch_size_opt = click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Evaluate the pipeline for batches of features. Pipelines of "
+    "vectorizable functions are evaluated once per batch.",
+)
+
+precision_opt = click.option(
+    "--precision",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Round coordinates of output geometries to this number of decimal places.",
+)
+
+explain_opt = click.option(
+    "--explain",
+    is_flag=True,
+    default=False,
+    help="Print the optimized pipeline and exit without reading input.",
+)
+
+stats_opt = click.option(
+    "--stats",
+    is_flag=True,
+    default=False,
+    help="Write the number of calls and time spent in each stage of processing "
+    "and each pipeline function to stderr. Functions evaluated by --jobs worker "
+    "processes are not counted.",
+)
+
+
+def _parse_bbox(ctx, param, value):
+    """Parse a "w,s,e,n" bounding box option."""
+    if value is None:
+        return None
+    try:
+        bbox = tuple(float(item) for item in value.replace(",", " ").split())
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise click.BadParameter("must be four numbers: w,s,e,n.")
+    return bbox
+
+
+input_opt = click.option(
+    "--input",
+    "input_path",
+    default=None,
+    metavar="PATH",
+    help="Read features from a dataset that Fiona can open instead of stdin.",
+)
+
+layer_opt = click.option(
+    "--layer", default=None, help="Name of a layer of the --input dataset."
+)
+
+bbox_opt = click.option(
+    "--bbox",
+    default=None,
+    metavar="w,s,e,n",
+    callback=_parse_bbox,
+    help="Read only --input features that intersect these bounds, in the "
+    "dataset's coordinate reference system.",
+)
+
+where_opt = click.option(
+    "--where",
+    default=None,
+    help="Read only --input features whose attributes satisfy this SQL WHERE "
+    "clause.",
+)
+
+
+def _parse_schema(ctx, param, value):
+    """Parse a JSON schema option."""
+    if value is None:
+        return None
+    try:
+        schema = json.loads(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    if not isinstance(schema, dict) or "properties" not in schema:
+        raise click.BadParameter("must be an object with a properties item.")
+    schema.setdefault("geometry", "Unknown")
+    return schema
+
+
+format_opt = click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["geojson", "wkb"]),
+    default="geojson",
+    help="Format of output features. 'wkb' is a binary stream of WKB "
+    "geometries and JSON properties which fio-planet commands read faster "
+    "than GeoJSON text.",
+)
+
+output_opt = click.option(
+    "--output",
+    "output_path",
+    default=None,
+    metavar="PATH",
+    help="Write features to a new dataset instead of stdout.",
+)
+
+driver_opt = click.option(
+    "--driver",
+    default=None,
+    help="OGR format driver of the --output dataset, such as GPKG. By default, "
+    "the driver is chosen by the extension of the path.",
+)
+
+schema_opt = click.option(
+    "--schema",
+    default=None,
+    callback=_parse_schema,
+    help="Fiona schema of the --output dataset as JSON text, such as "
+    '\'{"geometry": "Polygon", "properties": {"name": "str"}}\'. By default, '
+    "the schema is inferred from the first batch of features.",
+)
+
+write_batch_size_opt = click.option(
+    "--write-batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    help="Number of features written to the --output dataset in one transaction.",
+)
+
+queue_size_opt = click.option(
+    "--queue-size",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Read and decode input features, and write output, in background "
+    "threads, with up to this number of input features and output batches "
+    "waiting in queues. The default, 0, disables the threads.",
+)
+
+unordered_opt = click.option(
+    "--unordered",
+    is_flag=True,
+    default=False,
+    help="Write results of parallel evaluation as soon as they are ready, "
+    "not in input order.",
+)
+
+
+def start_stats():
+    """Collect Stats until the command ends, then write them to stderr."""
+    ctx = click.get_current_context()
+    stats = ctx.with_resource(collect_stats())
+    ctx.call_on_close(lambda: click.echo(stats.report(), err=True))
+
+
+def open_writer(
+    use_rs,
+    precision,
+    queue_size=0,
+    output_path=None,
+    driver=None,
+    schema=None,
+    write_batch_size=1000,
+    input_path=None,
+    layer=None,
+    output_format="geojson",
+):
+    """Get a Writer for stdout, or a DatasetWriter for an output dataset.
+
+    The writer is closed when the command ends. An output dataset has
+    the coordinate reference system of the input dataset, or OGC:CRS84
+    for GeoJSON input.
+
+    """
+    if output_path:
+        if input_path:
+            with fiona.open(input_path, layer=layer) as src:
+                crs = src.crs
+        else:
+            crs = "OGC:CRS84"
+        writer = DatasetWriter(
+            output_path,
+            driver=driver,
+            schema=schema,
+            crs=crs,
+            precision=precision,
+            batch_size=write_batch_size,
+        )
+    elif driver or schema:
+        raise click.UsageError("--driver and --schema require --output.")
+    elif output_format == "wkb":
+        writer = WkbWriter(click.get_binary_stream("stdout"), precision=precision)
+    else:
+        writer = Writer(
+            click.get_binary_stream("stdout"),
+            use_rs=use_rs,
+            precision=precision,
+            queue_size=queue_size,
+        )
+    return click.get_current_context().with_resource(writer)
 
-from .features import map_feature, reduce_features
+
+def report_write_errors(func):
+    """Report features that can not be written as command errors.
+
+    The command's writer is closed before it returns, so that errors
+    writing the last batch of features are reported too.
+
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+            click.get_current_context().close()
+            return result
+        except WriteError as exc:
+            raise click.ClickException(str(exc))
+
+    return wrapper
+
+
+def open_reader(queue_size=0, input_path=None, layer=None, bbox=None, where=None):
+    """Get the records of stdin or the features of an input dataset.
+
+    Stdin may be GeoJSON text or a binary feature stream. Files of
+    GeoJSON text, and stdin redirected from one, are read through a
+    memory map. Records are read ahead if queue_size is not 0.
+
+    """
+    if input_path and not (layer or bbox or where) and is_text_sequence(input_path):
+        records = MappedRecords(input_path)
+    elif input_path:
+        records = read_features(input_path, layer=layer, bbox=bbox, where=where)
+    elif layer or bbox or where:
+        raise click.UsageError("--layer, --bbox, and --where require --input.")
+    else:
+        records = open_records(click.get_binary_stream("stdin"))
+    return read_ahead(records, queue_size) if queue_size else records
 
 
 @click.command(
@@ -39,8 +340,51 @@ from .features import map_feature, reduce_features
     default=False,
     help="Dump parts of geometries to create new inputs before evaluating pipeline.",
 )
+@jobs_opt
+@threads_opt
+@unordered_opt
+@batch_size_opt
+@projection_opt
+@precision_opt
+@explain_opt
+@stats_opt
+@input_opt
+@layer_opt
+@bbox_opt
+@where_opt
+@format_opt
+@output_opt
+@driver_opt
+@schema_opt
+@write_batch_size_opt
+@queue_size_opt
 @use_rs_opt
-def map_cmd(pipeline, raw, no_input, dump_parts, use_rs):
+@report_write_errors
+def map_cmd(
+    pipeline,
+    raw,
+    no_input,
+    dump_parts,
+    jobs,
+    threads,
+    unordered,
+    batch_size,
+    crs,
+    precision,
+    explain,
+    stats,
+    input_path,
+    layer,
+    bbox,
+    where,
+    output_format,
+    output_path,
+    driver,
+    schema,
+    write_batch_size,
+    queue_size,
+    use_rs,
+):
     """Map a pipeline expression over GeoJSON features.
 
     Given a sequence of GeoJSON features (RS-delimited or not) on stdin
@@ -80,24 +424,76 @@ def map_cmd(pipeline, raw, no_input, dump_parts, use_rs):
 
         '(buffer g (/ (area g) 100.0))'
 
+    The area, buffer, distance, length, simplify, and set_precision
+    functions compute in the EPSG:6933 projection unless another CRS is
+    given by the --projection option or a function's :crs keyword
+    argument. The value 'auto-utm' selects the UTM zone that contains
+    the centroid of each geometry.
+
+        '(buffer g 100.0 :crs "auto-utm")'
+
+    The pipeline can be evaluated by a number of worker processes using
+    the --jobs option, or by a number of threads using the --threads
+    option. Results are written in the order of the input features
+    unless --unordered is used.
+
+    With the --batch-size option, pipelines such as '(buffer g 10)'
+    that consist only of vectorizable shapely functions are evaluated
+    for arrays of geometries, one call per function per batch.
+
     """
+    if jobs > 1 and threads > 1:
+        raise click.UsageError("--jobs and --threads can not be combined.")
+
+    if raw and (output_path or output_format != "geojson"):
+        raise click.UsageError("--raw can not be used with --output or --format.")
+
+    if crs:
+        click.get_current_context().with_resource(use_projection(crs))
+
+    if stats:
+        start_stats()
+
+    expression = compile_pipeline(pipeline)
+
+    if explain:
+        click.echo(explain_pipeline(expression))
+        return
+
+    writer = open_writer(
+        use_rs,
+        precision,
+        queue_size,
+        output_path,
+        driver,
+        schema,
+        write_batch_size,
+        input_path,
+        layer,
+        output_format,
+    )
+
     if no_input:
         features = [None]
     else:
-        stdin = click.get_text_stream("stdin")
-        features = obj_gen(stdin)
-
-    for feat in features:
-        for i, value in enumerate(map_feature(pipeline, feat, dump_parts=dump_parts)):
-            if use_rs:
-                click.echo("\x1e", nl=False)
-            if raw:
-                click.echo(json.dumps(value))
-            else:
-                new_feat = copy(feat)
-                new_feat["id"] = f"{feat.get('id', '0')}:{i}"
-                new_feat["geometry"] = value
-                click.echo(json.dumps(new_feat))
+        features = open_reader(queue_size, input_path, layer, bbox, where)
+
+    for feat, values in map_features(
+        expression,
+        features,
+        dump_parts=dump_parts,
+        jobs=jobs,
+        threads=threads,
+        ordered=not unordered,
+        chunk_size=batch_size or 100,
+        batch=bool(batch_size),
+        as_mapping=False,
+    ):
+        if raw:
+            for value in values:
+                writer.write(value)
+        else:
+            writer.write_parts(feat, values)
 
 
 @click.command(
@@ -105,8 +501,48 @@ def map_cmd(pipeline, raw, no_input, dump_parts, use_rs):
     short_help="Evaluate pipeline expressions to filter GeoJSON features.",
 )
 @click.argument("pipeline")
+@jobs_opt
+@threads_opt
+@unordered_opt
+@batch_size_opt
+@projection_opt
+@precision_opt
+@explain_opt
+@stats_opt
+@input_opt
+@layer_opt
+@bbox_opt
+@where_opt
+@format_opt
+@output_opt
+@driver_opt
+@schema_opt
+@write_batch_size_opt
+@queue_size_opt
 @use_rs_opt
-def filter_cmd(pipeline, use_rs):
+@report_write_errors
+def filter_cmd(
+    pipeline,
+    jobs,
+    threads,
+    unordered,
+    batch_size,
+    crs,
+    precision,
+    explain,
+    stats,
+    input_path,
+    layer,
+    bbox,
+    where,
+    output_format,
+    output_path,
+    driver,
+    schema,
+    write_batch_size,
+    queue_size,
+    use_rs,
+):
     """Evaluate pipeline expressions to filter GeoJSON features.
 
     The pipeline is a string that, when evaluated, gives a new value
@@ -130,16 +566,58 @@ def filter_cmd(pipeline, use_rs):
     lets through all features that are less than one unit from the
     given point and filters out all other features.
 
-    """
-    stdin = click.get_text_stream("stdin")
-    features = obj_gen(stdin)
+    Features pass through the filter unchanged. The text of a feature
+    is written exactly as it was read unless --precision is used.
+
+    The pipeline can be evaluated by a number of worker processes using
+    the --jobs option, or threads using the --threads option. Features
+    are written in input order unless --unordered is used. With the
+    --batch-size option, pipelines such as '(< (area g) 1e6)' are
+    evaluated for arrays of geometries.
 
-    for feat in features:
-        for value in map_feature(pipeline, feat):
+    """
+    if jobs > 1 and threads > 1:
+        raise click.UsageError("--jobs and --threads can not be combined.")
+
+    if crs:
+        click.get_current_context().with_resource(use_projection(crs))
+
+    if stats:
+        start_stats()
+
+    expression = compile_pipeline(pipeline)
+
+    if explain:
+        click.echo(explain_pipeline(expression))
+        return
+
+    writer = open_writer(
+        use_rs,
+        precision,
+        queue_size,
+        output_path,
+        driver,
+        schema,
+        write_batch_size,
+        input_path,
+        layer,
+        output_format,
+    )
+
+    features = open_reader(queue_size, input_path, layer, bbox, where)
+
+    for feat, values in map_features(
+        expression,
+        features,
+        jobs=jobs,
+        threads=threads,
+        ordered=not unordered,
+        chunk_size=batch_size or 100,
+        batch=bool(batch_size),
+    ):
+        for value in values:
             if value:
-                if use_rs:
-                    click.echo("\x1e", nl=False)
-                click.echo(json.dumps(feat))
+                writer.write_record(feat)
 
 
 @click.command("reduce", short_help="Reduce a stream of GeoJSON features to one value.")
@@ -158,7 +636,41 @@ def filter_cmd(pipeline, use_rs):
     default=False,
     help="Zip the items of input feature properties together for output.",
 )
-def reduce_cmd(pipeline, raw, use_rs, zip_properties):
+@projection_opt
+@precision_opt
+@explain_opt
+@stats_opt
+@input_opt
+@layer_opt
+@bbox_opt
+@where_opt
+@format_opt
+@output_opt
+@driver_opt
+@schema_opt
+@write_batch_size_opt
+@queue_size_opt
+@report_write_errors
+def reduce_cmd(
+    pipeline,
+    raw,
+    use_rs,
+    zip_properties,
+    crs,
+    precision,
+    explain,
+    stats,
+    input_path,
+    layer,
+    bbox,
+    where,
+    output_format,
+    output_path,
+    driver,
+    schema,
+    write_batch_size,
+    queue_size,
+):
     """Reduce a stream of GeoJSON features to one value.
 
     Given a sequence of GeoJSON features (RS-delimited or not) on stdin
@@ -187,32 +699,108 @@ def reduce_cmd(pipeline, raw, use_rs, zip_properties):
     containing the input values.
 
     """
-    stdin = click.get_text_stream("stdin")
-    features = (feat for feat in obj_gen(stdin))
+    if raw and (output_path or output_format != "geojson"):
+        raise click.UsageError("--raw can not be used with --output or --format.")
+
+    if crs:
+        click.get_current_context().with_resource(use_projection(crs))
+
+    if stats:
+        start_stats()
+
+    expression = compile_pipeline(pipeline)
+
+    if explain:
+        click.echo(explain_pipeline(expression))
+        return
+
+    writer = open_writer(
+        use_rs,
+        precision,
+        queue_size,
+        output_path,
+        driver,
+        schema,
+        write_batch_size,
+        input_path,
+        layer,
+        output_format,
+    )
+
+    features = open_reader(queue_size, input_path, layer, bbox, where)
+    properties: dict = defaultdict(list)
 
     if zip_properties:
-        prop_features, geom_features = itertools.tee(features)
-        properties = defaultdict(list)
-        for feat in prop_features:
-            for key, val in feat["properties"].items():
-                properties[key].append(val)
-    else:
-        geom_features = features
-        properties = {}
+        features = zip_feature_properties(features, properties)
 
-    for result in reduce_features(pipeline, geom_features):
-        if use_rs:
-            click.echo("\x1e", nl=False)
+    for result in reduce_features(expression, features, as_mapping=False):
         if raw:
-            click.echo(json.dumps(result))
+            writer.write(result)
         else:
-            click.echo(
-                json.dumps(
-                    {
-                        "type": "Feature",
-                        "properties": properties,
-                        "geometry": result,
-                        "id": "0",
-                    }
-                )
+            writer.write(
+                {
+                    "type": "Feature",
+                    "properties": dict(properties),
+                    "geometry": result,
+                    "id": "0",
+                }
             )
+
+
+@click.command("join", short_help="Join GeoJSON features to the features of a dataset.")
+@click.argument("dataset")
+@click.option("--layer", default=None, help="Name of a layer of the dataset.")
+@click.option(
+    "--predicate",
+    type=click.Choice(join_predicates),
+    default="intersects",
+    help="Spatial predicate of an input geometry and a dataset geometry.",
+)
+@click.option(
+    "--how",
+    type=click.Choice(["inner", "left"]),
+    default="inner",
+    help="Drop input features that join no dataset feature (inner), or "
+    "write them unchanged (left).",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    help="Number of input features queried at once.",
+)
+@precision_opt
+@queue_size_opt
+@use_rs_opt
+@report_write_errors
+def join_cmd(dataset, layer, predicate, how, batch_size, precision, queue_size, use_rs):
+    """Join GeoJSON features to the features of a dataset.
+
+    Given a sequence of GeoJSON features (RS-delimited or not) on stdin
+    this prints a copy of each feature for every feature of the dataset
+    whose geometry satisfies a spatial predicate. The properties of the
+    dataset feature are added to the properties of the copy. Names of
+    dataset properties that are already used get a "_right" suffix.
+
+    For example, this command
+
+        fio join --predicate within zones.shp
+
+    joins input features to the zones that contain them.
+
+    The dataset's features are read into memory and indexed by an
+    STRtree. Its coordinate reference system must be the same as the
+    input's.
+
+    """
+    with fiona.open(dataset, layer=layer) as src:
+        others = [to_dict(feat) for feat in src]
+
+    writer = open_writer(use_rs, precision, queue_size)
+
+    features = open_reader(queue_size)
+
+    for feat in join_features(
+        features, others, predicate=predicate, how=how, chunk_size=batch_size
+    ):
+        writer.write(feat)
@@ -7,3 +7,7 @@ class PlanetError(Exception):
 
 class ReduceError(PlanetError):
     """Raised when an expression does not reduce to a single object."""
+
+
+class WriteError(PlanetError):
+    """Raised when features can not be written."""
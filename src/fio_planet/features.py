@@ -2,46 +2,127 @@
 
 """Operations on GeoJSON feature and geometry objects."""
 
-from collections import UserDict
-from functools import wraps
+import builtins
+from collections import Counter, UserDict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import lru_cache, wraps
 import itertools
-from typing import Generator, Iterable, Mapping, Union
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from fiona.transform import transform_geom  # type: ignore
+import fiona  # type: ignore
+from fiona.model import to_dict  # type: ignore
+import numpy as np
+from pyproj import Transformer  # type: ignore
 import shapely  # type: ignore
 import shapely.ops  # type: ignore
 from shapely.geometry import mapping, shape  # type: ignore
 from shapely.geometry.base import BaseGeometry, BaseMultipartGeometry  # type: ignore
 
 from .errors import ReduceError
+from .serialize import MappedRecords
+from .stats import get_stats, timed
 from . import snuggs
 
+# Conversions between geometries and GeoJSON-like dicts, counted as
+# stages.
+_mapping = timed("mapping")(mapping)
+
+
+@timed("shape")
+def _shape(obj: Any) -> BaseGeometry:
+    # Features read from a binary stream already have geometries.
+    return obj if isinstance(obj, BaseGeometry) else shape(obj)
+
+
 # Patch snuggs's func_map, extending it with Python builtins, geometry
 # methods and attributes, and functions exported in the shapely module
 # (such as set_precision).
 
 
+def _method(name: str) -> Callable:
+    """Make a function that gets a named attribute or calls a method."""
+
+    def func(obj, *args, **kwargs):
+        attr = getattr(obj, name)
+        return attr(*args, **kwargs) if callable(attr) else attr
+
+    func.__name__ = name
+    return func
+
+
+# Builtins, shapely functions, and shapely.ops functions by name. The
+# table is built once at import time. Builtins take precedence over
+# shapely, which takes precedence over shapely.ops.
+module_funcs = MappingProxyType(
+    {
+        **{name: getattr(shapely.ops, name) for name in dir(shapely.ops)},
+        **{name: getattr(shapely, name) for name in dir(shapely)},
+        **{
+            name: val
+            for name, val in vars(builtins).items()
+            if not name.startswith("__")
+        },
+    }
+)
+
+
 class FuncMapper(UserDict, Mapping):
-    """Resolves functions from names in pipeline expressions."""
+    """Resolves functions from names in pipeline expressions.
+
+    Registered functions take precedence over the functions in
+    module_funcs. Other names resolve to functions that call the named
+    method of, or get the named attribute of, their first argument.
+    Resolved names are memoized.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._methods: dict = {}
+        super().__init__(*args, **kwargs)
 
     def __getitem__(self, key):
         """Get a function by its name."""
         if key in self.data:
             return self.data[key]
-        elif key in __builtins__ and not key.startswith("__"):
-            return __builtins__[key]
-        elif key in dir(shapely):
-            return lambda g, *args, **kwargs: getattr(shapely, key)(g, *args, **kwargs)
-        elif key in dir(shapely.ops):
-            return lambda g, *args, **kwargs: getattr(shapely.ops, key)(
-                g, *args, **kwargs
-            )
+        elif key in module_funcs:
+            return module_funcs[key]
         else:
-            return (
-                lambda g, *args, **kwargs: getattr(g, key)(*args, **kwargs)
-                if callable(getattr(g, key))
-                else getattr(g, key)
-            )
+            try:
+                return self._methods[key]
+            except KeyError:
+                return self._methods.setdefault(key, _method(key))
+
+    def register(self, name: str, func: Callable) -> None:
+        """Register a function for use in pipeline expressions.
+
+        Parameters
+        ----------
+        name : str
+            The name of the function in expressions.
+        func : callable
+            The function.
+
+        """
+        self.data[name] = func
 
 
 def collect(geoms: Iterable) -> object:
@@ -127,9 +208,130 @@ def vertex_count(obj: object) -> int:
         return len(shp.coords)
 
 
+# The projection used by the area, buffer, distance, length, simplify,
+# and set_precision functions when no crs keyword argument is given.
+# "auto-utm" selects the UTM zone of each geometry.
+AUTO_UTM = "auto-utm"
+projection: ContextVar = ContextVar("projection", default="EPSG:6933")
+
+
+@contextmanager
+def use_projection(crs: str) -> Generator:
+    """Set the default projection within a context.
+
+    Parameters
+    ----------
+    crs : str
+        A CRS identifier such as "EPSG:3857" or "auto-utm".
+
+    """
+    token = projection.set(crs)
+    try:
+        yield
+    finally:
+        projection.reset(token)
+
+
+@lru_cache(maxsize=None)
+def get_transformer(src_crs: str, dst_crs: str) -> Transformer:
+    """Get a cached coordinate transformer.
+
+    Parameters
+    ----------
+    src_crs : str
+        Source coordinate reference system, e.g. "OGC:CRS84".
+    dst_crs : str
+        Destination coordinate reference system, e.g. "EPSG:6933".
+
+    Returns
+    -------
+    pyproj.Transformer
+
+    """
+    return Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+
+def utm_crs(geom) -> Union[str, np.ndarray]:
+    """Get the UTM zone coordinate reference system of a geometry.
+
+    The zone is the one which contains the centroid of the geometry.
+    Empty geometries, which have no centroid, get the zone of (0, 0).
+
+    Parameters
+    ----------
+    geom : a shapely geometry object or an array of them.
+        Coordinates are longitude and latitude in decimal degrees.
+
+    Returns
+    -------
+    str or array of str
+        A CRS identifier such as "EPSG:32631".
+
+    """
+    centroid = np.array(shapely.centroid(geom), dtype=object)
+    # The coordinates of missing centroids are NaN.
+    centroid[shapely.is_empty(centroid)] = None
+    lon = np.nan_to_num(shapely.get_x(centroid))
+    lat = np.nan_to_num(shapely.get_y(centroid))
+    zone = np.clip(np.floor((lon + 180.0) / 6.0).astype(int) + 1, 1, 60)
+    code = np.where(lat < 0, 32700, 32600) + zone
+    result = np.char.add("EPSG:", code.astype(str))
+    return result if result.ndim else str(result)
+
+
+def _resolve_crs(crs: Optional[str], geom) -> Union[str, np.ndarray]:
+    """Get the projection for a geometry or array of geometries."""
+    crs = crs or projection.get()
+    return utm_crs(geom) if crs == AUTO_UTM else crs
+
+
+@timed("transform")
+def _transform(src_crs, dst_crs, geom):
+    """Transform the coordinates of a geometry or array of geometries.
+
+    Either CRS may be an array of CRS identifiers, one per geometry.
+
+    """
+    for crs_array in (src_crs, dst_crs):
+        if isinstance(crs_array, np.ndarray):
+            geom = np.broadcast_to(np.asarray(geom, dtype=object), crs_array.shape)
+            result = np.empty(crs_array.shape, dtype=object)
+            for crs in map(str, np.unique(crs_array)):
+                mask = crs_array == crs
+                result[mask] = _transform.__wrapped__(
+                    crs if src_crs is crs_array else src_crs,
+                    crs if dst_crs is crs_array else dst_crs,
+                    geom[mask],
+                )
+            return result
+
+    transformer = get_transformer(src_crs, dst_crs)
+
+    def func(coords):
+        # pyproj's point optimization is used for single coordinates.
+        if len(coords) == 1:
+            return np.array([transformer.transform(*coords[0])])
+        else:
+            return np.column_stack(transformer.transform(*coords.T))
+
+    has_z = shapely.has_z(geom)
+
+    if not np.any(has_z):
+        return shapely.transform(geom, func)
+    elif np.all(has_z):
+        return shapely.transform(geom, func, include_z=True)
+    else:
+        result = shapely.transform(geom, func)
+        result[has_z] = shapely.transform(geom[has_z], func, include_z=True)
+        return result
+
+
 def binary_projectable_property_wrapper(func):
     """Project func's geometry args before computing a property.
 
+    Both geometries are projected to the CRS of the first when the
+    projection is "auto-utm".
+
     Parameters
     ----------
     func : callable
@@ -138,15 +340,17 @@ def binary_projectable_property_wrapper(func):
     Returns
     -------
     callable
-        Signature is func(geom1, geom2, projected=True, *args, **kwargs)
+        Signature is func(geom1, geom2, projected=True, crs=None, *args,
+        **kwargs)
 
     """
 
     @wraps(func)
-    def wrapper(geom1, geom2, *args, projected=True, **kwargs):
+    def wrapper(geom1, geom2, *args, projected=True, crs=None, **kwargs):
         if projected:
-            geom1 = shape(transform_geom("OGC:CRS84", "EPSG:6933", mapping(geom1)))
-            geom2 = shape(transform_geom("OGC:CRS84", "EPSG:6933", mapping(geom2)))
+            crs = _resolve_crs(crs, geom1)
+            geom1 = _transform("OGC:CRS84", crs, geom1)
+            geom2 = _transform("OGC:CRS84", crs, geom2)
 
         return func(geom1, geom2, *args, **kwargs)
 
@@ -164,14 +368,14 @@ def unary_projectable_property_wrapper(func):
     Returns
     -------
     callable
-        Signature is func(geom1, projected=True, *args, **kwargs)
+        Signature is func(geom1, projected=True, crs=None, *args, **kwargs)
 
     """
 
     @wraps(func)
-    def wrapper(geom, *args, projected=True, **kwargs):
+    def wrapper(geom, *args, projected=True, crs=None, **kwargs):
         if projected:
-            geom = shape(transform_geom("OGC:CRS84", "EPSG:6933", mapping(geom)))
+            geom = _transform("OGC:CRS84", _resolve_crs(crs, geom), geom)
 
         return func(geom, *args, **kwargs)
 
@@ -189,16 +393,17 @@ def unary_projectable_constructive_wrapper(func):
     Returns
     -------
     callable
-        Signature is func(geom1, projected=True, *args, **kwargs)
+        Signature is func(geom1, projected=True, crs=None, *args, **kwargs)
 
     """
 
     @wraps(func)
-    def wrapper(geom, *args, projected=True, **kwargs):
+    def wrapper(geom, *args, projected=True, crs=None, **kwargs):
         if projected:
-            geom = shape(transform_geom("OGC:CRS84", "EPSG:6933", mapping(geom)))
+            crs = _resolve_crs(crs, geom)
+            geom = _transform("OGC:CRS84", crs, geom)
             product = func(geom, *args, **kwargs)
-            return shape(transform_geom("EPSG:6933", "OGC:CRS84", mapping(product)))
+            return _transform(crs, "OGC:CRS84", product)
         else:
             return func(geom, *args, **kwargs)
 
@@ -212,16 +417,240 @@ set_precision = unary_projectable_constructive_wrapper(shapely.set_precision)
 simplify = unary_projectable_constructive_wrapper(shapely.simplify)
 length = unary_projectable_property_wrapper(shapely.length)
 
+
+def _chunks(geoms: Iterable, chunk_size: int) -> Generator:
+    """Split a sequence of geometries into arrays of chunk_size."""
+    geoms = iter(geoms)
+    while True:
+        chunk = list(itertools.islice(geoms, chunk_size))
+        if not chunk:
+            return
+        arr = np.empty(len(chunk), dtype=object)
+        arr[:] = chunk
+        yield arr
+
+
+def chunked_union(geoms: Iterable, chunk_size: int = 1000) -> BaseGeometry:
+    """Dissolve a sequence of geometries, one chunk at a time.
+
+    The union of each chunk is merged into a running result, so that no
+    more than chunk_size input geometries are held in memory.
+
+    Parameters
+    ----------
+    geoms : Iterable
+        A sequence of geometry objects.
+    chunk_size : int, optional (default: 1000)
+        Number of geometries dissolved at once.
+
+    Returns
+    -------
+    Geometry
+
+    """
+    result = shapely.GeometryCollection()
+    for chunk in _chunks(geoms, chunk_size):
+        result = shapely.union_all(np.append(chunk, result))
+    return result
+
+
+def convex_hull_all(geoms: Iterable, chunk_size: int = 1000) -> BaseGeometry:
+    """Get the convex hull of a sequence of geometries.
+
+    Parameters
+    ----------
+    geoms : Iterable
+        A sequence of geometry objects.
+    chunk_size : int, optional (default: 1000)
+        Number of geometries considered at once.
+
+    Returns
+    -------
+    Geometry
+
+    """
+    result = shapely.GeometryCollection()
+    for chunk in _chunks(geoms, chunk_size):
+        result = shapely.GeometryCollection(list(chunk) + [result]).convex_hull
+    return result
+
+
+def total_bounds(geoms: Iterable, chunk_size: int = 1000) -> tuple:
+    """Get the bounds of a sequence of geometries.
+
+    Parameters
+    ----------
+    geoms : Iterable
+        A geometry object or a sequence of them.
+    chunk_size : int, optional (default: 1000)
+        Number of geometries considered at once.
+
+    Returns
+    -------
+    tuple
+        minx, miny, maxx, maxy. The values are NaN if there are no
+        non-empty geometries.
+
+    """
+    if isinstance(geoms, (BaseGeometry, np.ndarray)):
+        return tuple(shapely.total_bounds(geoms).tolist())
+
+    result = np.full(4, np.nan)
+    for chunk in _chunks(geoms, chunk_size):
+        bounds = np.vstack([shapely.total_bounds(chunk), result])
+        # The bounds of empty chunks are NaN.
+        bounds = bounds[~np.isnan(bounds).any(axis=1)]
+        if len(bounds):
+            result = np.concatenate(
+                [bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0)]
+            )
+    return tuple(result.tolist())
+
+
+def total_count(items: Iterable) -> int:
+    """Count the items of a sequence without keeping them.
+
+    Parameters
+    ----------
+    items : Iterable
+
+    Returns
+    -------
+    int
+
+    """
+    return sum(1 for _ in items)
+
+
+def total_area(geoms: Iterable, chunk_size: int = 1000, **kwargs) -> float:
+    """Get the sum of the areas of a sequence of geometries.
+
+    Parameters
+    ----------
+    geoms : Iterable
+        A sequence of geometry objects.
+    chunk_size : int, optional (default: 1000)
+        Number of geometries measured at once.
+    kwargs : dict
+        Keyword arguments for area(), such as projected and crs.
+
+    Returns
+    -------
+    float
+
+    """
+    return float(
+        sum(area(chunk, **kwargs).sum() for chunk in _chunks(geoms, chunk_size))
+    )
+
+
+def mean_area(geoms: Iterable, chunk_size: int = 1000, **kwargs) -> float:
+    """Get the mean of the areas of a sequence of geometries.
+
+    Parameters
+    ----------
+    geoms : Iterable
+        A sequence of geometry objects.
+    chunk_size : int, optional (default: 1000)
+        Number of geometries measured at once.
+    kwargs : dict
+        Keyword arguments for area(), such as projected and crs.
+
+    Returns
+    -------
+    float
+        NaN if the sequence is empty.
+
+    """
+    total = 0.0
+    count = 0
+    for chunk in _chunks(geoms, chunk_size):
+        total += area(chunk, **kwargs).sum()
+        count += len(chunk)
+    return total / count if count else float("nan")
+
+
+def read_geometry(path: str, layer: Optional[Union[str, int]] = None) -> BaseGeometry:
+    """Read the union of the geometries of a dataset.
+
+    Use this function to bring an area of interest into a pipeline, as
+    in (intersects g (read_geometry "aoi.geojson")). Pipelines read the
+    dataset only once.
+
+    Parameters
+    ----------
+    path : str
+        Path or URL of a dataset that Fiona can open.
+    layer : str or int, optional
+        Name or index of a layer of the dataset.
+
+    Returns
+    -------
+    BaseGeometry
+
+    """
+    with fiona.open(path, layer=layer) as src:
+        geoms = [shape(feat["geometry"]) for feat in src if feat["geometry"]]
+
+    if len(geoms) == 1:
+        return geoms[0]
+    else:
+        return shapely.union_all(geoms)
+
+
+def read_features(
+    path: str,
+    layer: Optional[Union[str, int]] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    where: Optional[str] = None,
+) -> Generator:
+    """Read the features of a dataset.
+
+    The bbox and where filters are applied by OGR, using the spatial
+    index of the dataset's format if it has one.
+
+    Parameters
+    ----------
+    path : str
+        Path or URL of a dataset that Fiona can open.
+    layer : str or int, optional
+        Name or index of a layer of the dataset.
+    bbox : tuple, optional
+        Bounds (west, south, east, north) of an area in the coordinate
+        reference system of the dataset. Only features whose
+        geometries intersect the area are read.
+    where : str, optional
+        An SQL WHERE clause, such as "type = 'road'". Only features
+        whose attributes satisfy the clause are read.
+
+    Yields
+    ------
+    dict
+        GeoJSON-like features.
+
+    """
+    with fiona.open(path, layer=layer) as src:
+        for feat in src.filter(bbox=bbox, where=where):
+            yield to_dict(feat)
+
+
 snuggs.func_map = FuncMapper(
     area=area,
     buffer=buffer,
+    chunked_union=chunked_union,
     collect=collect,
+    convex_hull_all=convex_hull_all,
     distance=distance,
     dump=dump,
     identity=identity,
     length=length,
+    mean_area=mean_area,
+    read_geometry=read_geometry,
     simplify=simplify,
     set_precision=set_precision,
+    total_area=total_area,
+    total_bounds=total_bounds,
+    total_count=total_count,
     vertex_count=vertex_count,
     **{
         k: getattr(itertools, k)
@@ -231,8 +660,376 @@ snuggs.func_map = FuncMapper(
 )
 
 
+# Names of operators and functions that return True or False.
+predicate_funcs = frozenset(
+    [
+        "<",
+        "<=",
+        "==",
+        "!=",
+        ">=",
+        ">",
+        "truth",
+        "is",
+        "not",
+        "contains",
+        "contains_properly",
+        "covered_by",
+        "covers",
+        "crosses",
+        "disjoint",
+        "dwithin",
+        "equals",
+        "intersects",
+        "is_empty",
+        "is_valid",
+        "overlaps",
+        "touches",
+        "within",
+    ]
+)
+
+
+def _is_predicate(node: snuggs.Node) -> bool:
+    if isinstance(node, snuggs.BoolOp):
+        return all(_is_predicate(arg) for arg in node.args)
+    else:
+        return (
+            isinstance(node, snuggs.Call)
+            and isinstance(node.func, snuggs.Const)
+            and node.func.name in predicate_funcs
+        )
+
+
+def order_conditions(node: snuggs.Node) -> None:
+    """Move conditions that do not use "g" to the front.
+
+    The operands of "and" and "or" expressions are reordered so that
+    cheap tests of feature properties are evaluated before geometry
+    predicates and can skip them. Only expressions whose operands are
+    all predicates are reordered, because their value does not depend
+    on the order of evaluation.
+
+    Parameters
+    ----------
+    node : snuggs.Node
+        The root of an expression tree, which is modified in place.
+
+    Returns
+    -------
+    None
+
+    """
+    for item in snuggs.walk(node):
+        if isinstance(item, snuggs.BoolOp) and _is_predicate(item):
+            item.args.sort(key=lambda arg: "g" in snuggs.names(arg))
+
+
+# Types of values that constant subexpressions may be replaced by.
+# Mutable values and iterators are excluded, because each evaluation of
+# an expression must get a new one.
+foldable_types = (
+    str,
+    int,
+    float,
+    bool,
+    tuple,
+    type(None),
+    BaseGeometry,
+    BaseMultipartGeometry,
+)
+
+
+def fold_constants(node: snuggs.Node) -> snuggs.Node:
+    """Evaluate subexpressions that do not use any variables.
+
+    Parameters
+    ----------
+    node : snuggs.Node
+        The root of an expression tree. Its descendants are replaced
+        in place.
+
+    Returns
+    -------
+    snuggs.Node
+        A constant node, or the given node.
+
+    """
+    if not isinstance(node, snuggs.Call):
+        return node
+
+    if not snuggs.names(node):
+        try:
+            value = node.evaluate()
+        except Exception:
+            # The error is raised again when the expression is
+            # evaluated.
+            pass
+        else:
+            if isinstance(value, foldable_types):
+                return snuggs.Const(value)
+
+    node.args[:] = [fold_constants(arg) for arg in node.args]
+    for key, val in node.kwds.items():
+        node.kwds[key] = fold_constants(val)
+    return node
+
+
+# Predicates that use a prepared geometry given as their first argument,
+# and the predicates to use when their arguments are swapped.
+prepared_predicates = {
+    "contains": "within",
+    "contains_properly": None,
+    "covered_by": "covers",
+    "covers": "covered_by",
+    "disjoint": "disjoint",
+    "intersects": "intersects",
+    "overlaps": "overlaps",
+    "touches": "touches",
+    "within": "contains",
+}
+
+# Constant geometries with at least this many parts are indexed by an
+# STRtree for intersects and disjoint tests.
+index_min_parts = 16
+
+
+def _is_const_geom(node: snuggs.Node) -> bool:
+    return isinstance(node, snuggs.Const) and isinstance(
+        node.value, (BaseGeometry, BaseMultipartGeometry)
+    )
+
+
+def _tree_predicate(geom: BaseGeometry, name: str) -> Callable:
+    """Make an intersects or disjoint test that queries a tree of parts."""
+    tree = shapely.STRtree(shapely.get_parts(geom))
+    negate = name == "disjoint"
+
+    def func(_, other):
+        if isinstance(other, np.ndarray):
+            hits = np.zeros(other.shape, dtype=bool)
+            hits[tree.query(other, predicate="intersects")[0]] = True
+        else:
+            hits = tree.query(other, predicate="intersects").size > 0
+        return hits != negate
+
+    return func
+
+
+def prepare_constants(node: snuggs.Node) -> None:
+    """Prepare constant geometries for repeated predicate tests.
+
+    Shapely uses a prepared geometry only when it is the first argument
+    of a predicate. The arguments of predicates with a constant second
+    argument are swapped, changing the predicate to its converse, and
+    the constant is prepared. Constants with many parts are indexed
+    instead.
+
+    Parameters
+    ----------
+    node : snuggs.Node
+        The root of an expression tree, which is modified in place.
+
+    Returns
+    -------
+    None
+
+    """
+    for item in snuggs.walk(node):
+        if not (
+            isinstance(item, snuggs.Call)
+            and isinstance(item.func, snuggs.Const)
+            and item.func.name in prepared_predicates
+            and len(item.args) == 2
+            and not item.kwds
+        ):
+            continue
+
+        name = item.func.name
+        first, second = item.args
+
+        if _is_const_geom(second) and not _is_const_geom(first):
+            name = prepared_predicates[name]
+            if name is None:
+                continue
+            item.func = snuggs.Const(snuggs.func_map[name], name)
+            item.args[:] = [second, first]
+            first = second
+
+        if not _is_const_geom(first):
+            continue
+        elif (
+            name in ("intersects", "disjoint")
+            and shapely.get_num_geometries(first.value) >= index_min_parts
+        ):
+            item.func = snuggs.Const(_tree_predicate(first.value, name), name)
+        else:
+            shapely.prepare(first.value)
+
+
+def _node_key(node: snuggs.Node) -> tuple:
+    """Get a key which is equal for equivalent expression trees."""
+    if isinstance(node, snuggs.Var):
+        return ("var", node.name)
+    elif isinstance(node, snuggs.Const):
+        if node.name:
+            return ("func", node.name)
+        elif isinstance(node.value, (str, int, float, bool, type(None))):
+            return ("value", type(node.value), node.value)
+        else:
+            return ("object", id(node.value))
+    elif isinstance(node, snuggs.Call):
+        return (
+            type(node).__name__,
+            _node_key(node.func),
+            tuple(_node_key(arg) for arg in node.args),
+            tuple((key, _node_key(val)) for key, val in node.kwds.items()),
+        )
+    else:
+        return ("node", id(node))
+
+
+def share_subexpressions(node: snuggs.Node) -> snuggs.Node:
+    """Evaluate repeated subexpressions once per evaluation.
+
+    Repeated subexpressions which use variables, such as (area g) in
+    (if (> (area g) 1e6) (buffer g (/ (area g) 1e3)) g), are replaced by
+    a shared node. Functions are assumed to be pure. Values of the
+    foldable types and arrays are reused, others are computed again.
+
+    Parameters
+    ----------
+    node : snuggs.Node
+        The root of an expression tree. Its descendants are replaced
+        in place.
+
+    Returns
+    -------
+    snuggs.Node
+
+    """
+    counts = Counter(
+        _node_key(item)
+        for item in snuggs.walk(node)
+        if isinstance(item, snuggs.Call) and snuggs.names(item)
+    )
+    shared: dict = {}
+
+    def rewrite(item):
+        if not isinstance(item, snuggs.Call):
+            return item
+
+        key = _node_key(item)
+        if key in shared:
+            return shared[key]
+
+        item.args[:] = [rewrite(arg) for arg in item.args]
+        for name, val in item.kwds.items():
+            item.kwds[name] = rewrite(val)
+
+        if counts[key] > 1:
+            shared[key] = snuggs.Shared(item, foldable_types + (np.ndarray,))
+            return shared[key]
+        else:
+            return item
+
+    return rewrite(node)
+
+
+def compile_pipeline(pipeline: str) -> snuggs.Expression:
+    """Compile a pipeline expression for repeated evaluation.
+
+    Subexpressions that do not use variables are evaluated once, at
+    compile time, in the current projection. Constant geometries
+    that are tested by predicates are prepared or indexed. Repeated
+    subexpressions are evaluated once per feature.
+
+    Parameters
+    ----------
+    pipeline : str
+        A snuggs expression. The outermost parentheses are optional.
+
+    Returns
+    -------
+    snuggs.Expression
+
+    """
+    if not (pipeline.startswith("(") and pipeline.endswith(")")):
+        pipeline = f"({pipeline})"
+
+    expression = snuggs.compile(pipeline)
+    expression.root = fold_constants(expression.root)
+    prepare_constants(expression.root)
+    order_conditions(expression.root)
+    expression.root = share_subexpressions(expression.root)
+
+    if get_stats() is not None:
+        instrument(expression.root)
+
+    return expression
+
+
+def instrument(node: snuggs.Node) -> None:
+    """Count the calls of an expression's functions as stages.
+
+    compile_pipeline() does this when statistics are being collected.
+    Each function call is counted under its expression, such as
+    "(area g)". The time of a call does not include the time spent
+    evaluating its arguments.
+
+    Parameters
+    ----------
+    node : snuggs.Node
+        The root of an expression tree, which is modified in place.
+
+    Returns
+    -------
+    None
+
+    """
+    seen = set()
+    for item in snuggs.walk(node):
+        if (
+            isinstance(item, snuggs.Call)
+            and not isinstance(item, (snuggs.BoolOp, snuggs.IfElse))
+            and isinstance(item.func, snuggs.Const)
+            and id(item) not in seen
+        ):
+            seen.add(id(item))
+            label = snuggs.unparse(item)
+            item.func = snuggs.Const(timed(label)(item.func.value), item.func.name)
+
+
+def explain_pipeline(expression: snuggs.Expression) -> str:
+    """Describe how a compiled pipeline is evaluated.
+
+    Parameters
+    ----------
+    expression : snuggs.Expression
+        An expression compiled by compile_pipeline().
+
+    Returns
+    -------
+    str
+        The optimized expression. Folded constants appear as values and
+        shared subexpressions are labeled, as in #1=(area g) and #1#.
+
+    """
+    return snuggs.unparse(expression.root)
+
+
+def _feature_shape(feature: Mapping) -> Optional[BaseGeometry]:
+    try:
+        return _shape(feature.get("geometry", None))
+    except (AttributeError, KeyError):
+        return None
+
+
 def map_feature(
-    expression: str, feature: Mapping, dump_parts: bool = False
+    expression: Union[str, snuggs.Expression],
+    feature: Mapping,
+    dump_parts: bool = False,
+    as_mapping: bool = True,
 ) -> Generator:
     """Map a pipeline expression to a feature.
 
@@ -240,60 +1037,588 @@ def map_feature(
 
     Parameters
     ----------
-    expression : str
-        A snuggs expression. The outermost parentheses are optional.
+    expression : str or snuggs.Expression
+        A snuggs expression or an expression compiled by
+        compile_pipeline(). The outermost parentheses are optional.
     feature : dict
         A Fiona feature object.
     dump_parts : bool, optional (default: False)
         If True, the parts of the feature's geometry are turned into
-        new features.
+        new features. A vectorizable expression is evaluated once for
+        an array of the parts.
+    as_mapping : bool, optional (default: True)
+        If True, geometries are yielded as GeoJSON-like mappings.
+        Otherwise they are yielded as Shapely geometries, which writers
+        serialize without making mappings.
 
     Yields
     ------
     object
 
     """
-    if not (expression.startswith("(") and expression.endswith(")")):
-        expression = f"({expression})"
+    if isinstance(expression, str):
+        expression = compile_pipeline(expression)
 
-    try:
-        geom = shape(feature.get("geometry", None))
-        if dump_parts and hasattr(geom, "geoms"):
-            parts = geom.geoms
-        else:
+    parts: Iterable
+
+    if dump_parts:
+        geom = _feature_shape(feature)
+        if geom is None:
             parts = [geom]
-    except (AttributeError, KeyError):
-        parts = [None]
+        else:
+            geoms = shapely.get_parts(geom)
+            if len(geoms) > 1 and is_vectorizable(expression.root):
+                values = _map_array(expression, geoms, as_mapping=as_mapping)
+                if values is not None:
+                    yield from values
+                    return
+            parts = geoms
+    else:
+        # The geometry is made only if the expression uses it.
+        parts = [snuggs.Lazy(lambda: _feature_shape(feature))]
 
     for part in parts:
-        result = snuggs.eval(expression, g=part, f=feature)
+        result = expression(g=part, f=feature)
         if isinstance(result, (str, float, int, Mapping)):
             yield result
         elif isinstance(result, (BaseGeometry, BaseMultipartGeometry)):
-            yield mapping(result)
+            yield _mapping(result) if as_mapping else result
         else:
             try:
                 for item in result:
-                    if isinstance(item, (BaseGeometry, BaseMultipartGeometry)):
-                        item = mapping(item)
+                    if as_mapping and isinstance(
+                        item, (BaseGeometry, BaseMultipartGeometry)
+                    ):
+                        item = _mapping(item)
                     yield item
             except TypeError:
                 yield result
 
 
-def reduce_features(expression: str, features: Iterable[Mapping]) -> Generator:
+# Names of operators and functions that apply elementwise to arrays of
+# geometries and values.
+vectorized_funcs = frozenset(
+    [
+        "*",
+        "+",
+        "/",
+        "-",
+        "&",
+        "|",
+        "<",
+        "<=",
+        "==",
+        "!=",
+        ">=",
+        ">",
+        "area",
+        "boundary",
+        "buffer",
+        "centroid",
+        "contains",
+        "convex_hull",
+        "covered_by",
+        "covers",
+        "crosses",
+        "difference",
+        "disjoint",
+        "distance",
+        "envelope",
+        "equals",
+        "get_num_coordinates",
+        "get_num_geometries",
+        "get_x",
+        "get_y",
+        "intersection",
+        "intersects",
+        "is_empty",
+        "is_valid",
+        "length",
+        "make_valid",
+        "normalize",
+        "overlaps",
+        "point_on_surface",
+        "reverse",
+        "set_precision",
+        "simplify",
+        "symmetric_difference",
+        "touches",
+        "union",
+        "within",
+    ]
+)
+
+
+def is_vectorizable(node: snuggs.Node) -> bool:
+    """Determine whether an expression can be evaluated for arrays.
+
+    An expression is vectorizable if its only variable is "g" and every
+    function that depends on "g" is in vectorized_funcs. Subexpressions
+    that do not depend on any variable are evaluated only once.
+
+    Parameters
+    ----------
+    node : snuggs.Node
+        The root of an expression tree.
+
+    Returns
+    -------
+    bool
+
+    """
+    if isinstance(node, snuggs.Var):
+        return node.name == "g"
+    elif isinstance(node, snuggs.Shared):
+        return is_vectorizable(node.node)
+    elif isinstance(node, snuggs.Call):
+        if not snuggs.names(node):
+            return True
+        return (
+            isinstance(node.func, snuggs.Const)
+            and node.func.name in vectorized_funcs
+            and all(
+                is_vectorizable(arg)
+                for arg in itertools.chain(node.args, node.kwds.values())
+            )
+        )
+    else:
+        return True
+
+
+def _map_array(
+    expression: snuggs.Expression, geoms: np.ndarray, as_mapping: bool = True
+) -> Optional[list]:
+    """Evaluate a vectorizable expression for an array of geometries.
+
+    Returns
+    -------
+    list or None
+        One value per geometry, or None if the expression does not
+        give an array of the same shape.
+
+    """
+    result = expression(g=geoms)
+
+    if not isinstance(result, np.ndarray) or result.shape != geoms.shape:
+        return None
+    elif result.dtype == object and as_mapping:
+        return [
+            (
+                _mapping(item)
+                if isinstance(item, (BaseGeometry, BaseMultipartGeometry))
+                else item
+            )
+            for item in result
+        ]
+    else:
+        return result.tolist()
+
+
+def map_batch(
+    expression: Union[str, snuggs.Expression],
+    features: Iterable[Mapping],
+    dump_parts: bool = False,
+    as_mapping: bool = True,
+) -> list:
+    """Map a pipeline expression to a batch of features.
+
+    Vectorizable pipelines are evaluated once for an array of all the
+    geometries in the batch, or of all their parts if dump_parts is
+    True, making one call per function. Other pipelines, and batches
+    which contain features without geometries, are evaluated feature
+    by feature.
+
+    Parameters
+    ----------
+    expression : str or snuggs.Expression
+        A snuggs expression or an expression compiled by
+        compile_pipeline(). The outermost parentheses are optional.
+    features : iterable
+        A sequence of Fiona feature objects.
+    dump_parts : bool, optional (default: False)
+        If True, the parts of the feature's geometry are turned into
+        new features.
+    as_mapping : bool, optional (default: True)
+        If False, geometries are Shapely geometries instead of
+        GeoJSON-like mappings.
+
+    Returns
+    -------
+    list
+        A list of the values that map_feature() yields for each
+        feature.
+
+    """
+    if isinstance(expression, str):
+        expression = compile_pipeline(expression)
+
+    features = list(features)
+
+    if (
+        features
+        and is_vectorizable(expression.root)
+        and all(feat and feat.get("geometry") for feat in features)
+    ):
+        geoms = np.empty(len(features), dtype=object)
+        geoms[:] = [_feature_shape(feat) for feat in features]
+
+        if dump_parts:
+            # The parts of every geometry in the batch are evaluated
+            # together and then regrouped by feature.
+            parts, index = shapely.get_parts(geoms, return_index=True)
+            if not len(parts):
+                return [[] for feat in features]
+            values = _map_array(expression, parts, as_mapping=as_mapping)
+            if values is not None:
+                counts = np.bincount(index, minlength=len(features)).tolist()
+                items = iter(values)
+                return [list(itertools.islice(items, count)) for count in counts]
+        else:
+            values = _map_array(expression, geoms, as_mapping=as_mapping)
+            if values is not None:
+                return [[item] for item in values]
+
+    return [
+        list(
+            map_feature(expression, feat, dump_parts=dump_parts, as_mapping=as_mapping)
+        )
+        for feat in features
+    ]
+
+
+def _pool_map(
+    executor, func, chunks: Iterator, window: int, ordered: bool = True
+) -> Generator:
+    """Map func over chunks using an executor.
+
+    No more than window chunks are in flight at any time, which keeps
+    memory use bounded for long input streams.
+
+    Yields
+    ------
+    tuple
+        A chunk and the result of func(chunk).
+
+    """
+    pending: dict = {}
+    queue: deque = deque()
+
+    def submit():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            future = executor.submit(func, chunk)
+            pending[future] = chunk
+            if ordered:
+                queue.append(future)
+
+    for _ in range(window):
+        submit()
+
+    while pending:
+        if ordered:
+            done = {queue.popleft()}
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            chunk = pending.pop(future)
+            submit()
+            yield chunk, future.result()
+
+
+_worker_expression: Optional[snuggs.Expression] = None
+_worker_dump_parts = False
+_worker_as_mapping = True
+_worker_records: Optional[MappedRecords] = None
+
+
+def _init_worker(
+    source: str,
+    dump_parts: bool,
+    crs: str,
+    path: Optional[str] = None,
+    as_mapping: bool = True,
+) -> None:
+    """Compile a pipeline once in a worker process."""
+    global _worker_expression, _worker_dump_parts, _worker_as_mapping
+    global _worker_records
+    # Constants are folded in the projection of the main process.
+    projection.set(crs)
+    _worker_expression = compile_pipeline(source)
+    _worker_dump_parts = dump_parts
+    _worker_as_mapping = as_mapping
+    if path:
+        _worker_records = MappedRecords(path)
+
+
+def _map_chunk(chunk: list) -> list:
+    """Map the worker's pipeline over a chunk of features."""
+    assert _worker_expression is not None
+    return map_batch(
+        _worker_expression,
+        chunk,
+        dump_parts=_worker_dump_parts,
+        as_mapping=_worker_as_mapping,
+    )
+
+
+def _map_range(byte_range: tuple) -> list:
+    """Map the worker's pipeline over the features in a byte range."""
+    assert _worker_records is not None
+    return _map_chunk(list(_worker_records.read(*byte_range)))
+
+
+def map_features(
+    expression: Union[str, snuggs.Expression],
+    features: Iterable[Mapping],
+    dump_parts: bool = False,
+    jobs: int = 1,
+    ordered: bool = True,
+    chunk_size: int = 100,
+    batch: bool = False,
+    threads: int = 1,
+    as_mapping: bool = True,
+) -> Generator:
+    """Map a pipeline expression to a sequence of features.
+
+    Parameters
+    ----------
+    expression : str or snuggs.Expression
+        A snuggs expression or an expression compiled by
+        compile_pipeline(). The outermost parentheses are optional.
+    features : iterable
+        A sequence of Fiona feature objects.
+    dump_parts : bool, optional (default: False)
+        If True, the parts of the feature's geometry are turned into
+        new features.
+    jobs : int, optional (default: 1)
+        Number of worker processes. If greater than 1, chunks of
+        features are evaluated in a process pool.
+    ordered : bool, optional (default: True)
+        If False, results of parallel evaluation are yielded as soon as
+        they are ready instead of in input order.
+    chunk_size : int, optional (default: 100)
+        Number of features sent to a worker process at once, or the
+        number of features in a batch. Worker processes read the
+        features of a MappedRecords opened by path themselves, in byte
+        ranges of this number of features.
+    batch : bool, optional (default: False)
+        If True, chunks of features are evaluated by map_batch(). Worker
+        processes and threads always evaluate in batches.
+    threads : int, optional (default: 1)
+        Number of worker threads. If greater than 1, chunks of features
+        are evaluated in a thread pool. Shapely releases the GIL while
+        it computes, so threads can run in parallel without copying
+        features to other processes. Can not be combined with jobs.
+    as_mapping : bool, optional (default: True)
+        If False, geometries are Shapely geometries instead of
+        GeoJSON-like mappings. Worker processes return them in their
+        compact pickled form.
+
+    Yields
+    ------
+    tuple
+        An input feature and a list of the values that map_feature()
+        yields for it.
+
+    Raises
+    ------
+    ValueError
+        If both jobs and threads are greater than 1.
+
+    """
+    if jobs > 1 and threads > 1:
+        raise ValueError("Worker processes and threads can not be combined.")
+
+    if isinstance(expression, str):
+        expression = compile_pipeline(expression)
+
+    if jobs <= 1 and threads <= 1 and not batch:
+        for feat in features:
+            yield feat, list(
+                map_feature(
+                    expression, feat, dump_parts=dump_parts, as_mapping=as_mapping
+                )
+            )
+        return
+
+    if jobs > 1 and isinstance(features, MappedRecords) and features.path:
+        # Workers read their features from byte ranges of the file, and
+        # the features of a range are read again here when its results
+        # are ready, so no features are copied between processes.
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(
+                expression.source,
+                dump_parts,
+                projection.get(),
+                features.path,
+                as_mapping,
+            ),
+        ) as pool:
+            for byte_range, results in _pool_map(
+                pool, _map_range, features.ranges(chunk_size), 2 * jobs, ordered=ordered
+            ):
+                yield from zip(features.read(*byte_range), results)
+        return
+
+    features = iter(features)
+    chunks = iter(lambda: list(itertools.islice(features, chunk_size)), [])
+
+    if threads > 1:
+        # Threads evaluate chunks in copies of this thread's context, so
+        # that they use the same projection.
+        context = copy_context()
+
+        def func(chunk):
+            return context.copy().run(
+                map_batch,
+                expression,
+                chunk,
+                dump_parts=dump_parts,
+                as_mapping=as_mapping,
+            )
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for chunk, results in _pool_map(
+                executor, func, chunks, 2 * threads, ordered=ordered
+            ):
+                yield from zip(chunk, results)
+        return
+
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from zip(
+                chunk,
+                map_batch(
+                    expression, chunk, dump_parts=dump_parts, as_mapping=as_mapping
+                ),
+            )
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(expression.source, dump_parts, projection.get(), None, as_mapping),
+    ) as pool:
+        for chunk, results in _pool_map(
+            pool, _map_chunk, chunks, 2 * jobs, ordered=ordered
+        ):
+            yield from zip(chunk, results)
+
+
+class GeometryStream:
+    """The geometries of a sequence of features, made on demand.
+
+    Iteration yields geometries one at a time without keeping them, so
+    that reducers which consume their input incrementally use bounded
+    memory. Functions that need the whole collection, such as len() or
+    shapely.unary_union(), get a list or array of all the geometries.
+
+    Parameters
+    ----------
+    features : iterable
+        A sequence of Fiona feature objects.
+
+    """
+
+    def __init__(self, features: Iterable[Mapping]):
+        self._features = iter(features)
+        self._geoms: Optional[list] = None
+        self._started = False
+
+    def _stream(self) -> Iterator:
+        if self._started:
+            raise ReduceError("The collection can only be iterated once.")
+        self._started = True
+        return (_shape(feat["geometry"]) for feat in self._features)
+
+    def materialize(self) -> list:
+        """Get a list of all the geometries."""
+        if self._geoms is None:
+            self._geoms = [geom for geom in self._stream()]
+        return self._geoms
+
+    def __iter__(self) -> Iterator:
+        if self._geoms is not None:
+            return iter(self._geoms)
+        else:
+            return self._stream()
+
+    def __len__(self) -> int:
+        if self._started and self._geoms is None:
+            # list() and other consumers ask for a length hint after
+            # they start iterating. A TypeError makes them go without.
+            raise TypeError("The length of a streamed collection is not known.")
+        return len(self.materialize())
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        geoms = self.materialize()
+        arr = np.empty(len(geoms), dtype=object)
+        arr[:] = geoms
+        return arr
+
+    def exhaust(self) -> None:
+        """Read all remaining features without making geometries."""
+        for _ in self._features:
+            pass
+
+
+def zip_feature_properties(
+    features: Iterable[Mapping], properties: MutableMapping
+) -> Generator:
+    """Collect the properties of features as they pass by.
+
+    Parameters
+    ----------
+    features : iterable
+        A sequence of Fiona feature objects.
+    properties : defaultdict(list)
+        The values of each feature property are appended to the list
+        under its key.
+
+    Yields
+    ------
+    Mapping
+        The input features.
+
+    """
+    for feat in features:
+        for key, val in feat["properties"].items():
+            properties[key].append(val)
+        yield feat
+
+
+def reduce_features(
+    expression: Union[str, snuggs.Expression],
+    features: Iterable[Mapping],
+    as_mapping: bool = True,
+) -> Generator:
     """Reduce a collection of features to a single value.
 
     The pipeline is a string that, when evaluated by snuggs, produces
     a new value. The name of the input feature collection in the
     context of the pipeline is "c".
 
+    The features are read in a single pass. If the pipeline uses "c"
+    at most once, it is a GeometryStream and reducers which iterate
+    over it do not keep all the geometries in memory. Otherwise, "c"
+    is a list. All input features are read, even if the pipeline does
+    not consume them.
+
     Parameters
     ----------
-    pipeline : str
-        Geometry operation pipeline such as "(unary_union c)".
+    expression : str or snuggs.Expression
+        Geometry operation pipeline such as "(unary_union c)", or an
+        expression compiled by compile_pipeline().
     features : iterable
         A sequence of Fiona feature objects.
+    as_mapping : bool, optional (default: True)
+        If False, a geometry is yielded as a Shapely geometry instead
+        of a GeoJSON-like mapping.
 
     Yields
     ------
@@ -304,15 +1629,111 @@ def reduce_features(expression: str, features: Iterable[Mapping]) -> Generator:
     ReduceError
 
     """
-    if not (expression.startswith("(") and expression.endswith(")")):
-        expression = f"({expression})"
-
-    collection = (shape(feat["geometry"]) for feat in features)
-    result = snuggs.eval(expression, c=collection)
-
-    if isinstance(result, (str, float, int, Mapping)):
+    if isinstance(expression, str):
+        expression = compile_pipeline(expression)
+
+    stream = GeometryStream(features)
+    uses = sum(
+        1
+        for node in snuggs.walk(expression.root)
+        if isinstance(node, snuggs.Var) and node.name == "c"
+    )
+    collection = stream if uses <= 1 else stream.materialize()
+    result = expression(c=collection)
+    stream.exhaust()
+
+    if isinstance(result, (str, float, int, tuple, Mapping)):
         yield result
     elif isinstance(result, (BaseGeometry, BaseMultipartGeometry)):
-        yield mapping(result)
+        yield _mapping(result) if as_mapping else result
     else:
         raise ReduceError("Expression failed to reduce to a single value.")
+
+
+# Predicates by which features may be joined.
+join_predicates = (
+    "intersects",
+    "contains",
+    "contains_properly",
+    "covered_by",
+    "covers",
+    "crosses",
+    "overlaps",
+    "touches",
+    "within",
+)
+
+
+def join_features(
+    features: Iterable[Mapping],
+    others: Iterable[Mapping],
+    predicate: str = "intersects",
+    how: str = "inner",
+    chunk_size: int = 1000,
+) -> Generator:
+    """Join features to other features by a spatial predicate.
+
+    The other features are indexed by an STRtree, which is queried for
+    chunks of input features at once. An input feature is joined to
+    each other feature for which predicate(feature geometry, other
+    geometry) is true.
+
+    Parameters
+    ----------
+    features : iterable
+        A sequence of Fiona feature objects.
+    others : iterable
+        A sequence of Fiona feature objects, which is read into memory.
+    predicate : str, optional (default: "intersects")
+        One of join_predicates.
+    how : str, optional (default: "inner")
+        If "left", input features which are joined to no other feature
+        are yielded unchanged. If "inner", they are dropped.
+    chunk_size : int, optional (default: 1000)
+        Number of input features queried at once.
+
+    Yields
+    ------
+    dict
+        Copies of input features, with the properties of an other
+        feature added to their properties. Names of other properties
+        which are already used get a "_right" suffix.
+
+    Raises
+    ------
+    ValueError
+        If the predicate or how is not supported.
+
+    """
+    if predicate not in join_predicates:
+        raise ValueError(f"Predicate {predicate!r} is not supported.")
+    if how not in ("inner", "left"):
+        raise ValueError(f"Join type {how!r} is not supported.")
+
+    other_props = []
+    other_geoms = []
+    for feat in others:
+        other_props.append(feat.get("properties") or {})
+        other_geoms.append(_feature_shape(feat))
+
+    tree = shapely.STRtree(other_geoms)
+
+    features = iter(features)
+    for chunk in iter(lambda: list(itertools.islice(features, chunk_size)), []):
+        geoms = [_feature_shape(feat) for feat in chunk]
+        matches: list = [[] for _ in chunk]
+        for i, j in zip(*tree.query(geoms, predicate=predicate).tolist()):
+            matches[i].append(j)
+
+        for feat, indices in zip(chunk, matches):
+            if not indices:
+                if how == "left":
+                    yield feat
+                continue
+
+            props = feat.get("properties") or {}
+            for j in sorted(indices):
+                joined = dict(props)
+                for key, val in other_props[j].items():
+                    joined[f"{key}_right" if key in props else key] = val
+                yield {**feat, "properties": joined}
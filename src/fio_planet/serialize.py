@@ -0,0 +1,1202 @@
+# serialize.py: decoding of input and encoding of output.
+
+"""Serialization of pipeline inputs and results."""
+
+from contextvars import copy_context
+import io
+import itertools
+import json
+import mmap
+import numbers
+import os
+import queue
+import re
+import stat
+import struct
+import threading
+from time import perf_counter
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
+
+import fiona  # type: ignore
+import numpy as np
+import shapely  # type: ignore
+from shapely.geometry import shape  # type: ignore
+from shapely.geometry.base import BaseGeometry  # type: ignore
+
+from .errors import WriteError
+from .stats import get_stats, timed
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import ujson  # type: ignore
+except ImportError:  # pragma: no cover
+    ujson = None  # type: ignore
+
+
+def _default(obj: Any) -> Any:
+    """Convert objects that JSON encoders do not support."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif hasattr(obj, "__geo_interface__"):
+        return obj.__geo_interface__
+    else:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def get_encoder(backend: str = "auto") -> Callable[[Any], bytes]:
+    """Get a function that encodes objects as UTF-8 JSON text.
+
+    Parameters
+    ----------
+    backend : str, optional (default: "auto")
+        One of "orjson", "ujson", or "json". "auto" selects the first of
+        these that is installed.
+
+    Returns
+    -------
+    callable
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown or not installed.
+
+    """
+    if backend == "auto":
+        backend = "orjson" if orjson else "ujson" if ujson else "json"
+
+    if backend == "orjson" and orjson:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        return lambda obj: orjson.dumps(obj, default=_default, option=option)
+    elif backend == "ujson" and ujson:
+        return lambda obj: ujson.dumps(
+            obj, ensure_ascii=False, default=_default
+        ).encode("utf-8")
+    elif backend == "json":
+        return lambda obj: json.dumps(obj, default=_default).encode("utf-8")
+    else:
+        raise ValueError(f"JSON backend {backend!r} is not available.")
+
+
+def get_decoder() -> Callable[[bytes], Any]:
+    """Get a function that decodes UTF-8 JSON text.
+
+    orjson is used if it is installed.
+
+    Returns
+    -------
+    callable
+
+    """
+    return orjson.loads if orjson else json.loads
+
+
+class Record(dict):
+    """A decoded JSON object and the text it was decoded from.
+
+    Attributes
+    ----------
+    raw : bytes
+        The JSON text of the object, without RS or newline delimiters.
+
+    """
+
+    raw: Optional[bytes] = None
+
+
+@timed("decode")
+def _decode(text: bytes, decode: Callable[[bytes], Any]) -> Any:
+    obj = decode(text)
+    if isinstance(obj, dict):
+        obj = Record(obj)
+        obj.raw = text
+    return obj
+
+
+def read_records(
+    lines: Iterable[bytes], decoder: Optional[Callable[[bytes], Any]] = None
+) -> Generator:
+    """Read a sequence of JSON texts.
+
+    Texts may be separated by newlines or, when the first one begins
+    with an RS (0x1E) character, by RS characters. RS-delimited texts
+    may span several lines.
+
+    Parameters
+    ----------
+    lines : iterable
+        Lines of UTF-8 text, such as a binary stdin stream.
+    decoder : callable, optional
+        A function that decodes a JSON text. By default, the decoder
+        returned by get_decoder() is used.
+
+    Yields
+    ------
+    Record or object
+        Decoded objects. JSON objects are yielded as Records which keep
+        their text.
+
+    """
+    decode = decoder or get_decoder()
+    lines = iter(lines)
+
+    for line in lines:
+        if line.strip():
+            break
+    else:
+        return
+
+    if line.startswith(b"\x1e"):
+        buffer = line
+        for line in lines:
+            if line.startswith(b"\x1e"):
+                text = buffer.strip(b"\x1e \t\r\n")
+                if text:
+                    yield _decode(text, decode)
+                buffer = line
+            else:
+                buffer += line
+        text = buffer.strip(b"\x1e \t\r\n")
+        if text:
+            yield _decode(text, decode)
+    else:
+        yield _decode(line.strip(), decode)
+        for line in lines:
+            text = line.strip()
+            if text:
+                yield _decode(text, decode)
+
+
+def _put(items: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item in a queue unless stopped, waiting while it is full."""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def read_ahead(items: Iterable, size: int = 100) -> Generator:
+    """Iterate over items in a background thread.
+
+    While the consumer works on one item, the thread reads and decodes
+    up to about size more. Exceptions raised by the iterable are raised
+    by this generator.
+
+    Items are handed over in lists, which are short while the consumer
+    is waiting and longer when the thread is ahead. This keeps the
+    threads from contending for the interpreter lock item by item.
+
+    Parameters
+    ----------
+    items : iterable
+        For example, the Records of read_records().
+    size : int, optional (default: 100)
+        Maximum number of items read ahead of the consumer.
+
+    Yields
+    ------
+    object
+
+    """
+    chunk_size = max(1, size // 4)
+    buffer: queue.Queue = queue.Queue(maxsize=max(1, size // chunk_size))
+    stop = threading.Event()
+
+    def produce():
+        chunk = []
+        try:
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= chunk_size or buffer.empty():
+                    if not _put(buffer, (chunk, None), stop):
+                        return
+                    chunk = []
+            _put(buffer, (chunk, StopIteration()), stop)
+        except BaseException as exc:
+            _put(buffer, (chunk, exc), stop)
+
+    # The thread runs in a copy of the current context so that its
+    # stages are counted by collect_stats().
+    thread = threading.Thread(target=copy_context().run, args=(produce,), daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            chunk, exc = buffer.get()
+            yield from chunk
+            if isinstance(exc, StopIteration):
+                return
+            elif exc is not None:
+                raise exc
+    finally:
+        # The thread may be blocked reading input, so it is not joined.
+        stop.set()
+
+
+# The first line of a binary feature stream. It is followed by one
+# frame per feature: the lengths of a JSON text and of a WKB geometry as
+# two little-endian unsigned 32 bit integers, then the JSON text of the
+# feature's members other than its geometry, then the WKB.
+WKB_MAGIC = b"FIO-PLANET-WKB 1\n"
+
+_frame_header = struct.Struct("<II")
+
+
+def _read_frames(
+    stream: BinaryIO, decoder: Optional[Callable[[bytes], Any]], batch_size: int
+) -> Generator:
+    decode = decoder or get_decoder()
+
+    while True:
+        texts = []
+        wkbs = []
+        for _ in range(batch_size):
+            header = stream.read(_frame_header.size)
+            if not header:
+                break
+            elif len(header) < _frame_header.size:
+                raise ValueError("Binary feature stream is truncated.")
+            text_size, wkb_size = _frame_header.unpack(header)
+            text = stream.read(text_size)
+            wkb = stream.read(wkb_size)
+            if len(text) < text_size or len(wkb) < wkb_size:
+                raise ValueError("Binary feature stream is truncated.")
+            texts.append(text)
+            wkbs.append(wkb or None)
+
+        if not texts:
+            return
+
+        stats = get_stats()
+        start = perf_counter()
+        geoms = shapely.from_wkb(wkbs)
+        features = []
+        for text, geom in zip(texts, geoms):
+            feat = decode(text)
+            feat["geometry"] = geom
+            features.append(feat)
+        if stats is not None:
+            stats.add("decode", perf_counter() - start, calls=len(features))
+
+        yield from features
+
+
+def read_wkb(
+    stream: BinaryIO,
+    decoder: Optional[Callable[[bytes], Any]] = None,
+    batch_size: int = 1000,
+) -> Generator:
+    """Read a binary feature stream written by WkbWriter.
+
+    Geometries are made by shapely.from_wkb() for batches of features.
+
+    Parameters
+    ----------
+    stream : file-like
+        A binary input stream which begins with WKB_MAGIC.
+    decoder : callable, optional
+        A function that decodes a JSON text. By default, the decoder
+        returned by get_decoder() is used.
+    batch_size : int, optional (default: 1000)
+        Number of features decoded at once.
+
+    Yields
+    ------
+    dict
+        GeoJSON-like features with shapely geometries.
+
+    Raises
+    ------
+    ValueError
+        If the stream is not a binary feature stream or is truncated.
+
+    """
+    if stream.readline() != WKB_MAGIC:
+        raise ValueError("Not a binary feature stream.")
+    yield from _read_frames(stream, decoder, batch_size)
+
+
+def read_stream(
+    stream: BinaryIO, decoder: Optional[Callable[[bytes], Any]] = None
+) -> Generator:
+    """Read a binary feature stream or a sequence of JSON texts.
+
+    The format is recognized by the first line of the stream.
+
+    Parameters
+    ----------
+    stream : file-like
+        A binary input stream such as click's binary stdin.
+    decoder : callable, optional
+        A function that decodes a JSON text. By default, the decoder
+        returned by get_decoder() is used.
+
+    Yields
+    ------
+    object
+        Features with shapely geometries, or the objects yielded by
+        read_records().
+
+    """
+    first = stream.readline()
+    if first == WKB_MAGIC:
+        yield from _read_frames(stream, decoder, 1000)
+    else:
+        yield from read_records(itertools.chain([first], stream), decoder=decoder)
+
+
+# The first non-whitespace byte of a text sequence.
+_first_byte = re.compile(rb"\S")
+
+# Bytes read to recognize a text sequence.
+_sniff_size = 65536
+
+
+class MappedRecords:
+    """The JSON texts of a file, read through a memory map.
+
+    Texts are separated by newlines or, when the first one begins with
+    an RS (0x1E) character, by RS characters. Boundaries are found by
+    scanning the mapped file, without reading it line by line, and
+    the file can be split into byte ranges that are read separately,
+    for example by worker processes.
+
+    Parameters
+    ----------
+    source : str or file-like
+        Path of a file, or a binary file object such as stdin redirected
+        from a regular file.
+    decoder : callable, optional
+        A function that decodes a JSON text. By default, the decoder
+        returned by get_decoder() is used.
+
+    Attributes
+    ----------
+    path : str or None
+        The path of the file, if it was opened by path. Only files
+        opened by path can be read by other processes.
+
+    """
+
+    def __init__(
+        self,
+        source: Union[str, BinaryIO],
+        decoder: Optional[Callable[[bytes], Any]] = None,
+    ):
+        self.path = source if isinstance(source, str) else None
+        self.decoder = decoder
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                self._map = _map_file(f)
+        else:
+            self._map = _map_file(source)
+        # Only the beginning of the file is read to find its framing.
+        first = _first_byte.search(self._map)
+        self._rs = first is not None and first.group() == b"\x1e"
+
+    def _bounds(self, start: int, end: int) -> Generator:
+        """Get the start and end of the texts that begin in a range."""
+        mm = self._map
+        size = len(mm)
+        end = min(end, size)
+        if self._rs:
+            pos = mm.find(b"\x1e", start)
+            while 0 <= pos < end:
+                stop = mm.find(b"\x1e", pos + 1)
+                yield pos + 1, stop if stop >= 0 else size
+                pos = stop
+        else:
+            pos = start
+            if pos > 0 and mm[pos - 1] != ord("\n"):
+                pos = mm.find(b"\n", pos) + 1 or size
+            while pos < end:
+                stop = mm.find(b"\n", pos)
+                if stop < 0:
+                    stop = size
+                yield pos, stop
+                pos = stop + 1
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> Generator:
+        """Read the texts that begin in a byte range.
+
+        Parameters
+        ----------
+        start : int, optional (default: 0)
+            Offset of the first byte of the range.
+        end : int, optional
+            Offset after the last byte of the range. By default, the
+            range extends to the end of the file.
+
+        Yields
+        ------
+        Record or object
+            Decoded objects, as read_records() yields them.
+
+        """
+        decode = self.decoder or get_decoder()
+        mm = self._map
+        for begin, stop in self._bounds(start, len(mm) if end is None else end):
+            text = mm[begin:stop].strip()
+            if text:
+                yield _decode(text, decode)
+
+    def ranges(self, count: int) -> Generator:
+        """Split the file into byte ranges of a number of texts.
+
+        Parameters
+        ----------
+        count : int
+            Number of texts in a range.
+
+        Yields
+        ------
+        tuple
+            The start and end offsets of a range.
+
+        """
+        size = len(self._map)
+        # RS-delimited texts begin at their RS character.
+        offset = 1 if self._rs else 0
+        starts = (begin - offset for begin, _ in self._bounds(0, size))
+        start = next(starts, None)
+        while start is not None:
+            next_start = next(itertools.islice(starts, count - 1, None), None)
+            yield start, size if next_start is None else next_start
+            start = next_start
+
+    def __iter__(self):
+        return self.read()
+
+
+def _map_file(f: BinaryIO) -> Union[mmap.mmap, bytes]:
+    """Map a file for reading. Empty files can not be mapped."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def is_text_sequence(path: str) -> bool:
+    """Determine whether a file is a sequence of GeoJSON feature texts.
+
+    Parameters
+    ----------
+    path : str
+        Path of a file.
+
+    Returns
+    -------
+    bool
+        True if the file begins with an RS character, or if its first
+        line is a GeoJSON feature. Only the beginning of the file is
+        read. A first line longer than that is taken to be a feature if
+        the beginning has a "Feature" type and no "features" member.
+
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        prefix = f.read(_sniff_size).lstrip()
+    if prefix.startswith(b"\x1e"):
+        return True
+    elif not prefix.startswith(b"{"):
+        return False
+    line, newline, _ = prefix.partition(b"\n")
+    if not newline and len(prefix) >= _sniff_size:
+        return b'"features"' not in prefix and bool(
+            re.search(rb'"type"\s*:\s*"Feature"', prefix)
+        )
+    try:
+        obj = get_decoder()(line)
+    except ValueError:
+        return False
+    return isinstance(obj, dict) and obj.get("type") == "Feature"
+
+
+def open_records(
+    stream: BinaryIO, decoder: Optional[Callable[[bytes], Any]] = None
+) -> Iterable:
+    """Get the records of a binary stream.
+
+    A stream which is a regular file, such as stdin redirected from a
+    file, is read through a memory map. Other streams are read by
+    read_stream().
+
+    Parameters
+    ----------
+    stream : file-like
+        A binary input stream such as click's binary stdin.
+    decoder : callable, optional
+        A function that decodes a JSON text. By default, the decoder
+        returned by get_decoder() is used.
+
+    Returns
+    -------
+    MappedRecords or iterator
+
+    """
+    try:
+        regular = stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+        regular = regular and stream.tell() == 0
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        regular = False
+
+    if regular:
+        records = MappedRecords(stream, decoder=decoder)
+        if not records._map[: len(WKB_MAGIC)] == WKB_MAGIC:
+            return records
+
+    return read_stream(stream, decoder=decoder)
+
+
+def _round(coords: Any, precision: int) -> Any:
+    if not coords:
+        return coords
+    elif isinstance(coords[0], (int, float)):
+        return [round(val, precision) for val in coords]
+    else:
+        return [_round(item, precision) for item in coords]
+
+
+def round_coordinates(obj: Any, precision: int) -> Any:
+    """Round the coordinates of a GeoJSON feature or geometry.
+
+    Shapely geometries are rounded as GeoJSON-like mappings. Other
+    objects are returned unchanged. The input is not modified.
+
+    Parameters
+    ----------
+    obj : object
+        A GeoJSON-like feature or geometry mapping.
+    precision : int
+        Number of decimal places.
+
+    Returns
+    -------
+    object
+
+    """
+    if isinstance(obj, BaseGeometry):
+        obj = obj.__geo_interface__
+    if not isinstance(obj, dict):
+        return obj
+    elif "coordinates" in obj:
+        return {**obj, "coordinates": _round(obj["coordinates"], precision)}
+    elif "geometries" in obj:
+        return {
+            **obj,
+            "geometries": [
+                round_coordinates(geom, precision) for geom in obj["geometries"]
+            ],
+        }
+    elif obj.get("geometry"):
+        return {**obj, "geometry": round_coordinates(obj["geometry"], precision)}
+    else:
+        return obj
+
+
+class Writer:
+    """Writes a sequence of JSON texts to a binary stream in batches.
+
+    Parameters
+    ----------
+    stream : file-like
+        A binary output stream such as click's binary stdout.
+    use_rs : bool, optional (default: False)
+        If True, each text is preceded by an RS (0x1E) character.
+    precision : int, optional
+        Coordinates of features and geometries are rounded to this
+        number of decimal places.
+    encoder : callable, optional
+        A function that encodes an object as bytes. By default, the
+        encoder returned by get_encoder() is used.
+    batch_size : int, optional (default: 1000)
+        Number of texts written to the stream at once.
+    queue_size : int, optional (default: 0)
+        If greater than 0, batches are written to the stream by a
+        background thread and up to this number of batches wait to be
+        written. The writer must be closed to finish writing.
+
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        use_rs: bool = False,
+        precision: Optional[int] = None,
+        encoder: Optional[Callable[[Any], bytes]] = None,
+        batch_size: int = 1000,
+        queue_size: int = 0,
+    ):
+        self.stream = stream
+        self.precision = precision
+        self.encode = encoder or get_encoder()
+        self.batch_size = batch_size
+        self._prefix = b"\x1e" if use_rs else b""
+        self._buffer: List[Any] = []
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+        if queue_size > 0:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._drain, daemon=True)
+            self._thread.start()
+
+    @timed("encode")
+    def write(self, obj: Any) -> None:
+        """Encode and write an object.
+
+        Shapely geometries, and the Shapely geometries of features, are
+        encoded when the batch is written.
+
+        """
+        if isinstance(obj, BaseGeometry):
+            self._write_geometry(b"", obj, b"")
+        elif isinstance(obj, Mapping) and isinstance(obj.get("geometry"), BaseGeometry):
+            # Members before and after the geometry keep their order.
+            before: dict = {}
+            after: dict = {}
+            members = before
+            for key, value in obj.items():
+                if key == "geometry":
+                    members = after
+                else:
+                    members[key] = value
+            head = self.encode(before)[:-1]
+            tail = self.encode(after)[1:]
+            self._write_geometry(
+                head + (b"," if len(head) > 1 else b"") + b'"geometry":',
+                obj["geometry"],
+                (b"," if len(tail) > 1 else b"") + tail,
+            )
+        else:
+            if self.precision is not None:
+                obj = round_coordinates(obj, self.precision)
+            self.write_bytes(self.encode(obj))
+
+    def write_record(self, record: Any) -> None:
+        """Write a Record's original text, or encode and write an object.
+
+        The original text is written unchanged when coordinates are not
+        rounded and it fits on a single line.
+
+        """
+        raw = getattr(record, "raw", None)
+        if self.precision is None and raw is not None and b"\n" not in raw:
+            self.write_bytes(raw)
+        else:
+            self.write(record)
+
+    @timed("encode")
+    def write_parts(self, feature: Mapping, geometries: Iterable) -> None:
+        """Write copies of a feature with each of a sequence of geometries.
+
+        The id of each copy is the feature's id followed by a colon and
+        the copy's index. Members of the feature other than its id and
+        geometry, such as its properties, are encoded only once.
+
+        Parameters
+        ----------
+        feature : dict
+            A GeoJSON-like feature.
+        geometries : iterable
+            Shapely or GeoJSON-like geometries, or other values.
+
+        """
+        feature = feature or {}
+        fid = feature.get("id", "0")
+        keys = list(feature) + [key for key in ("id", "geometry") if key not in feature]
+        # Encoded members, and the names of the members which vary.
+        members = [
+            (
+                (self.encode(key) + b":", key)
+                if key in ("id", "geometry")
+                else (self.encode(key) + b":" + self.encode(feature[key]), None)
+            )
+            for key in keys
+        ]
+
+        # The geometry's value goes between the head and tail texts.
+        end = keys.index("geometry") + 1
+
+        for i, geometry in enumerate(geometries):
+            texts = [
+                text + self.encode(f"{fid}:{i}") if key == "id" else text
+                for text, key in members
+            ]
+            head = b"{" + b",".join(texts[:end])
+            tail = b"".join(b"," + text for text in texts[end:]) + b"}"
+            if isinstance(geometry, BaseGeometry):
+                self._write_geometry(head, geometry, tail)
+            else:
+                if self.precision is not None:
+                    geometry = round_coordinates(geometry, self.precision)
+                self.write_bytes(head + self.encode(geometry) + tail)
+
+    def write_bytes(self, data: bytes) -> None:
+        """Write an encoded JSON text."""
+        self._buffer.append(self._prefix + data + b"\n")
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def _write_geometry(self, head: bytes, geometry: BaseGeometry, tail: bytes) -> None:
+        """Write a JSON text with a Shapely geometry between its parts."""
+        self._buffer.append([self._prefix + head, geometry, tail + b"\n"])
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def _encode_geometries(self, geometries: list) -> list:
+        """Encode Shapely geometries as GeoJSON.
+
+        Geometries are encoded together by shapely.to_geojson(), except
+        for geometries with Z coordinates and empty geometries, which it
+        does not encode like mapping() does.
+
+        """
+        geoms = np.empty(len(geometries), dtype=object)
+        geoms[:] = geometries
+        simple = ~(shapely.has_z(geoms) | shapely.is_empty(geoms))
+        texts = np.empty(len(geoms), dtype=object)
+
+        if simple.any():
+            flat = geoms[simple]
+            if self.precision is not None:
+                flat = shapely.transform(
+                    flat, lambda coords: np.round(coords, self.precision)
+                )
+            texts[simple] = [text.encode() for text in shapely.to_geojson(flat)]
+
+        for i in np.flatnonzero(~simple):
+            obj = geoms[i].__geo_interface__
+            if self.precision is not None:
+                obj = round_coordinates(obj, self.precision)
+            texts[i] = self.encode(obj)
+
+        return texts.tolist()
+
+    def _join(self) -> bytes:
+        """Join buffered texts, encoding their Shapely geometries."""
+        pending = [item for item in self._buffer if isinstance(item, list)]
+        if pending:
+            texts = self._encode_geometries([item[1] for item in pending])
+            for item, text in zip(pending, texts):
+                item[1] = text
+        data = b"".join(
+            item if isinstance(item, bytes) else b"".join(item) for item in self._buffer
+        )
+        self._buffer.clear()
+        return data
+
+    @timed("write")
+    def flush(self) -> None:
+        """Write buffered texts to the stream.
+
+        With a queue, the texts are handed to the background thread,
+        waiting while the queue is full.
+
+        """
+        if self._queue is None:
+            if self._buffer:
+                self.stream.write(self._join())
+            self.stream.flush()
+        elif self._buffer:
+            data = self._join()
+            if not _put(self._queue, data, self._stop):
+                raise self._error or RuntimeError("Writer is closed.")
+
+    def _drain(self) -> None:
+        """Write batches from the queue until closed."""
+        try:
+            while True:
+                data = self._queue.get()  # type: ignore
+                if data is None:
+                    break
+                self.stream.write(data)
+                self.stream.flush()
+        except BaseException as exc:
+            self._error = exc
+        finally:
+            self._stop.set()
+
+    def close(self) -> None:
+        """Flush the writer and wait for queued batches to be written."""
+        self.flush()
+        if self._thread is not None:
+            _put(self._queue, None, self._stop)  # type: ignore
+            self._thread.join()
+            self._thread = None
+            if self._error is not None:
+                raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        self.close()
+
+
+class WkbWriter:
+    """Writes features to a binary stream in batches.
+
+    The stream begins with WKB_MAGIC and can be read by read_wkb() or
+    read_stream(). Geometries are encoded by shapely.to_wkb() for
+    batches of features. It has the interface of Writer.
+
+    Parameters
+    ----------
+    stream : file-like
+        A binary output stream such as click's binary stdout.
+    precision : int, optional
+        Coordinates of geometries are rounded to this number of decimal
+        places.
+    encoder : callable, optional
+        A function that encodes an object as bytes. By default, the
+        encoder returned by get_encoder() is used.
+    batch_size : int, optional (default: 1000)
+        Number of features written to the stream at once.
+
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        precision: Optional[int] = None,
+        encoder: Optional[Callable[[Any], bytes]] = None,
+        batch_size: int = 1000,
+    ):
+        self.stream = stream
+        self.precision = precision
+        self.encode = encoder or get_encoder()
+        self.batch_size = batch_size
+        self._texts: List[bytes] = []
+        self._geoms: List[Any] = []
+        self._started = False
+
+    def _append(self, text: bytes, geometry: Any) -> None:
+        _check_geometry(geometry, "a binary feature stream")
+        self._texts.append(text)
+        self._geoms.append(geometry)
+        if len(self._texts) >= self.batch_size:
+            self.flush()
+
+    @timed("encode")
+    def write(self, obj: Any) -> None:
+        """Encode and write a GeoJSON-like feature."""
+        members = {key: value for key, value in obj.items() if key != "geometry"}
+        self._append(self.encode(members), obj.get("geometry"))
+
+    def write_record(self, record: Any) -> None:
+        """Encode and write a Record or other GeoJSON-like feature."""
+        self.write(record)
+
+    @timed("encode")
+    def write_parts(self, feature: Mapping, geometries: Iterable) -> None:
+        """Write copies of a feature with each of a sequence of geometries.
+
+        The id of each copy is the feature's id followed by a colon and
+        the copy's index. Members of the feature other than its id and
+        geometry are encoded only once.
+
+        """
+        feature = feature or {}
+        fid = feature.get("id", "0")
+        rest = self.encode(
+            {
+                key: value
+                for key, value in feature.items()
+                if key not in ("id", "geometry")
+            }
+        )[1:]
+        for i, geometry in enumerate(geometries):
+            text = b'{"id":' + self.encode(f"{fid}:{i}")
+            self._append(text + (b"," + rest if rest != b"}" else rest), geometry)
+
+    @timed("write")
+    def flush(self) -> None:
+        """Encode buffered geometries and write buffered features."""
+        if not self._started:
+            self.stream.write(WKB_MAGIC)
+            self._started = True
+
+        if self._texts:
+            geoms = np.empty(len(self._geoms), dtype=object)
+            geoms[:] = [
+                geom if geom is None or isinstance(geom, BaseGeometry) else shape(geom)
+                for geom in self._geoms
+            ]
+            if self.precision is not None:
+                geoms = shapely.transform(
+                    geoms, lambda coords: np.round(coords, self.precision)
+                )
+            chunks = []
+            for text, wkb in zip(self._texts, shapely.to_wkb(geoms)):
+                wkb = wkb or b""
+                chunks.extend([_frame_header.pack(len(text), len(wkb)), text, wkb])
+            self.stream.write(b"".join(chunks))
+            self._texts.clear()
+            self._geoms.clear()
+
+        self.stream.flush()
+
+    def close(self) -> None:
+        """Flush the writer."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        self.close()
+
+
+def _field_kind(value: Any) -> str:
+    if isinstance(value, numbers.Integral):
+        return "int"
+    elif isinstance(value, numbers.Real):
+        return "float"
+    else:
+        return "str"
+
+
+def infer_schema(features: Iterable[Mapping]) -> Dict[str, Any]:
+    """Infer a Fiona schema from a sequence of features.
+
+    The geometry type is the type of every geometry, or "Unknown" if
+    geometries have several types. Fields are made for every property
+    and have the "int" or "float" type if all their values are numbers,
+    and the "str" type otherwise.
+
+    Parameters
+    ----------
+    features : iterable
+        GeoJSON-like features.
+
+    Returns
+    -------
+    dict
+
+    """
+    geom_types = set()
+    kinds: Dict[str, set] = {}
+
+    for feat in features:
+        geom = feat.get("geometry")
+        if isinstance(geom, BaseGeometry):
+            geom_types.add(geom.geom_type)
+        elif geom:
+            geom_types.add(geom["type"])
+        for name, value in (feat.get("properties") or {}).items():
+            kinds.setdefault(name, set())
+            if value is not None:
+                kinds[name].add(_field_kind(value))
+
+    properties = {}
+    for name, kind in kinds.items():
+        if kind == {"int"}:
+            properties[name] = "int"
+        elif kind and kind <= {"int", "float"}:
+            properties[name] = "float"
+        else:
+            properties[name] = "str"
+
+    return {
+        "geometry": geom_types.pop() if len(geom_types) == 1 else "Unknown",
+        "properties": properties,
+    }
+
+
+def _geometry_mapping(geom: Any) -> Any:
+    return geom.__geo_interface__ if isinstance(geom, BaseGeometry) else geom
+
+
+def _check_geometry(geom: Any, destination: str) -> None:
+    """Raise WriteError if a value is not a geometry or None."""
+    if not (geom is None or isinstance(geom, (BaseGeometry, Mapping))):
+        raise WriteError(
+            f"Only geometries can be written to {destination}, "
+            f"not values of type {type(geom).__name__}."
+        )
+
+
+def _field_value(value: Any, field_type: str) -> Any:
+    if isinstance(value, np.generic):
+        value = value.item()
+    if field_type.startswith("str") and isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, ensure_ascii=False, default=_default)
+    return value
+
+
+class DatasetWriter:
+    """Writes features to a dataset in batches.
+
+    It has the interface of Writer, but writes features with Fiona
+    instead of encoding them as JSON text. Each batch is written by one
+    call of Collection.writerecords(), which uses one transaction for
+    formats that support them, such as GeoPackage.
+
+    Parameters
+    ----------
+    path : str
+        Path of the new dataset.
+    driver : str, optional
+        Name of an OGR format driver, such as "GPKG". By default, the
+        driver is chosen by the extension of the path.
+    schema : dict, optional
+        A Fiona schema. By default, the schema is inferred from the
+        first batch of features by infer_schema().
+    crs : str, optional (default: "OGC:CRS84")
+        The coordinate reference system of the features.
+    precision : int, optional
+        Coordinates of features are rounded to this number of decimal
+        places.
+    batch_size : int, optional (default: 1000)
+        Number of features written at once.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        driver: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        crs: Any = "OGC:CRS84",
+        precision: Optional[int] = None,
+        batch_size: int = 1000,
+    ):
+        self.path = path
+        self.driver = driver
+        self.schema = schema
+        self.crs = crs
+        self.precision = precision
+        self.batch_size = batch_size
+        self._collection = None
+        self._buffer: List[Mapping] = []
+        self._inferred = False
+        self._closed = False
+
+    def write(self, obj: Any) -> None:
+        """Write a GeoJSON-like feature."""
+        try:
+            _check_geometry(obj.get("geometry"), self.path)
+        except WriteError:
+            self._discard()
+            raise
+        if self.precision is not None:
+            obj = round_coordinates(obj, self.precision)
+        self._buffer.append(obj)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_record(self, record: Any) -> None:
+        """Write a Record or other GeoJSON-like feature."""
+        self.write(record)
+
+    def write_parts(self, feature: Mapping, geometries: Iterable) -> None:
+        """Write copies of a feature with each of a sequence of geometries.
+
+        The id of each copy is the feature's id followed by a colon and
+        the copy's index.
+
+        """
+        feature = feature or {}
+        fid = feature.get("id", "0")
+        for i, geometry in enumerate(geometries):
+            self.write({**feature, "id": f"{fid}:{i}", "geometry": geometry})
+
+    def _conform(self, feature: Mapping) -> Dict[str, Any]:
+        """Make the properties of a feature match the schema."""
+        fields = self.schema["properties"]  # type: ignore
+        properties = feature.get("properties") or {}
+        extra = set(properties) - set(fields)
+        if extra:
+            message = (
+                f"Properties {sorted(extra)} are not in the schema of {self.path}."
+            )
+            if self._inferred:
+                message += (
+                    " The schema was inferred from the first batch of features."
+                    " Give a schema or use a larger batch size."
+                )
+            raise WriteError(message)
+        return {
+            "type": "Feature",
+            "id": feature.get("id"),
+            "properties": {
+                name: _field_value(properties.get(name), field_type)
+                for name, field_type in fields.items()
+            },
+            "geometry": _geometry_mapping(feature.get("geometry")),
+        }
+
+    def _open(self) -> None:
+        if self.schema is None:
+            self.schema = infer_schema(self._buffer)
+            self._inferred = True
+        self._collection = fiona.open(
+            self.path, "w", driver=self.driver, schema=self.schema, crs=self.crs
+        )
+
+    def _discard(self) -> None:
+        """Remove a partly written dataset and stop writing."""
+        self._buffer.clear()
+        self._closed = True
+        if self._collection is not None:
+            self._collection.close()
+            self._collection = None
+            fiona.remove(self.path, driver=self.driver)
+
+    @timed("write")
+    def flush(self) -> None:
+        """Write buffered features to the dataset.
+
+        If a feature can not be written, the dataset is removed and
+        WriteError is raised.
+
+        """
+        if self._buffer:
+            if self._collection is None:
+                self._open()
+            try:
+                records = [self._conform(feat) for feat in self._buffer]
+            except WriteError:
+                self._discard()
+                raise
+            self._collection.writerecords(records)  # type: ignore
+            self._buffer.clear()
+
+    def close(self) -> None:
+        """Flush the writer and close the dataset."""
+        if self._closed:
+            return
+        self.flush()
+        if self._collection is None:
+            self._open()
+        self._collection.close()  # type: ignore
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        self.close()
@@ -26,8 +26,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from collections import OrderedDict
+from contextvars import ContextVar
 import functools
+import itertools
 import operator
 import re
 from typing import Mapping
@@ -49,54 +50,179 @@ from pyparsing import (  # type: ignore
     replace_with,
 )
 
-__all__ = ["eval"]
+__all__ = ["compile", "eval"]
 __version__ = "1.4.7"
 
 
-class Context(object):
-    def __init__(self):
-        self._data = OrderedDict()
+# The frame of the expression being evaluated: a list of the values of
+# its variables and shared subexpressions, indexed by slot. Each thread
+# and async task has its own.
+_ctx: ContextVar = ContextVar("snuggs_frame", default=None)
 
-    def add(self, name, val):
-        self._data[name] = val
 
-    def get(self, name):
-        return self._data[name]
+class _Missing:
+    """Marks a slot which has no value."""
 
-    def lookup(self, index, subindex=None):
-        s = list(self._data.values())[int(index) - 1]
-        if subindex:
-            return s[int(subindex) - 1]
-        else:
-            return s
+    def __repr__(self):
+        return "<missing>"
 
-    def clear(self):
-        self._data = OrderedDict()
 
+_missing = _Missing()
 
-_ctx = Context()
 
+class ExpressionError(SyntaxError):
+    """A Snuggs-specific syntax error."""
 
-class ctx(object):
-    def __init__(self, kwd_dict=None, **kwds):
-        self.kwds = kwd_dict or kwds
+    filename = "<string>"
+    lineno = 1
 
-    def __enter__(self):
-        _ctx.clear()
-        for k, v in self.kwds.items():
-            _ctx.add(k, v)
-        return self
 
-    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
-        self.kwds = None
-        _ctx.clear()
+class Node:
+    """A node of a compiled expression tree."""
 
+    def evaluate(self):
+        raise NotImplementedError
 
-class ExpressionError(SyntaxError):
-    """A Snuggs-specific syntax error."""
 
-    filename = "<string>"
-    lineno = 1
+class Const(Node):
+    """A literal value or a resolved function and its name."""
+
+    def __init__(self, value, name=None):
+        self.value = value
+        self.name = name
+
+    def evaluate(self):
+        return self.value
+
+
+class Lazy:
+    """A context value which is computed when it is first used.
+
+    Parameters
+    ----------
+    func : callable
+        A function of no arguments which returns the value.
+
+    """
+
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+
+class Var(Node):
+    """A name which is resolved when the expression is evaluated.
+
+    The value is read from the slot of the evaluation frame that the
+    name is assigned when the expression is compiled.
+
+    """
+
+    def __init__(self, name, source, loc):
+        self.name = name
+        self.source = source
+        self.loc = loc
+        self.index = None
+
+    def evaluate(self):
+        frame = _ctx.get()
+        try:
+            value = frame[self.index]
+        except TypeError:
+            value = _missing
+
+        if value is _missing:
+            err = ExpressionError("name '{}' is not defined".format(self.name))
+            err.text = self.source
+            err.offset = self.loc + 1
+            raise err
+        elif isinstance(value, Lazy):
+            value = frame[self.index] = value.func()
+        return value
+
+
+class Call(Node):
+    """A function call with positional and keyword argument nodes."""
+
+    def __init__(self, func, args, kwds):
+        self.func = func
+        self.args = args
+        self.kwds = kwds
+
+    def evaluate(self):
+        func = self.func.evaluate()
+        args = [arg.evaluate() for arg in self.args]
+        kwds = {key: val.evaluate() for key, val in self.kwds.items()}
+
+        # list and tuple are two builtins that take a single argument,
+        # whereas args is a list. On a TypeError, the call is retried
+        # without arg unpacking.
+        try:
+            return func(*args, **kwds)
+        except TypeError:
+            return func(args, **kwds)
+
+
+class BoolOp(Call):
+    """An "and" or "or" expression.
+
+    Arguments are evaluated in order until the result is known, as with
+    Python's and and or operators.
+
+    """
+
+    def evaluate(self):
+        stop = self.func.name == "or"
+        for arg in self.args:
+            value = arg.evaluate()
+            if bool(value) is stop:
+                break
+        return value
+
+
+class IfElse(Call):
+    """An "if" expression.
+
+    The first argument is a test. The second argument is evaluated if
+    the test is true, and the optional third argument otherwise.
+
+    """
+
+    def evaluate(self):
+        if self.args[0].evaluate():
+            return self.args[1].evaluate()
+        elif len(self.args) > 2:
+            return self.args[2].evaluate()
+        else:
+            return None
+
+
+class Shared(Node):
+    """A subexpression which is used more than once.
+
+    Its value is computed once per evaluation of an expression and
+    kept in a slot of the evaluation frame, if it is an instance of the
+    given types.
+
+    """
+
+    def __init__(self, node, cacheable=object):
+        self.node = node
+        self.cacheable = cacheable
+        self.index = None
+
+    def evaluate(self):
+        frame = _ctx.get()
+        if frame is None:
+            return self.node.evaluate()
+
+        value = frame[self.index]
+        if value is _missing:
+            value = self.node.evaluate()
+            if isinstance(value, self.cacheable):
+                frame[self.index] = value
+        return value
 
 
 op_map = {
@@ -115,6 +241,9 @@ op_map = {
     "truth": operator.truth,
     "is": operator.is_,
     "not": operator.not_,
+    "and": lambda *args: functools.reduce(lambda x, y: x and y, args),
+    "or": lambda *args: functools.reduce(lambda x, y: x or y, args),
+    "if": lambda test, *args: args[0] if test else (args[1:] or [None])[0],
 }
 
 
@@ -144,28 +273,25 @@ true = Keyword("true").set_parse_action(replace_with(True))
 false = Keyword("false").set_parse_action(replace_with(False))
 
 
-def resolve_var(source, loc, toks):
-    try:
-        return _ctx.get(toks[0])
-    except KeyError:
-        err = ExpressionError("name '{}' is not defined".format(toks[0]))
-        err.text = source
-        err.offset = loc + 1
-        raise err
-
-
-var = pyparsing_common.identifier.set_parse_action(resolve_var)
+# A copy of the identifier is used so that the parse action does not
+# leak into other users of pyparsing_common.
+var = pyparsing_common.identifier.copy().set_parse_action(
+    lambda source, loc, toks: Var(toks[0], source, loc)
+)
 string = QuotedString("'") | QuotedString('"')
 lparen = Literal("(").suppress()
 rparen = Literal(")").suppress()
-op = oneOf(" ".join(op_map.keys())).set_parse_action(
-    lambda source, loc, toks: op_map[toks[0]]
-)
+# Operators that are words must not match the start of a function name
+# such as is_empty.
+op = (
+    oneOf([key for key in op_map if not key.isalpha()])
+    | oneOf([key for key in op_map if key.isalpha()], as_keyword=True)
+).set_parse_action(lambda source, loc, toks: Const(op_map[toks[0]], toks[0]))
 
 
 def resolve_func(source, loc, toks):
     try:
-        return func_map[toks[0]]
+        return Const(func_map[toks[0]], toks[0])
     except (AttributeError, KeyError):
         err = ExpressionError("'{}' is not a function or operator".format(toks[0]))
         err.text = source
@@ -178,7 +304,7 @@ def resolve_func(source, loc, toks):
 func = Regex(r"(?<=\()[{}]+".format(alphanums + "_")).set_parse_action(resolve_func)
 
 higher_func = oneOf(" ".join(higher_func_map.keys())).set_parse_action(
-    lambda source, loc, toks: higher_func_map[toks[0]]
+    lambda source, loc, toks: Const(higher_func_map[toks[0]], toks[0])
 )
 
 func_expr = Forward()
@@ -222,48 +348,192 @@ higher_func_expr << Group(
 )
 
 
-def processArg(arg):
-    if isinstance(arg, ParseResults):
-        return processList(arg)
-    else:
-        return arg
-
+def build(item):
+    """Convert a parse result to a tree of expression nodes."""
+    if isinstance(item, Node):
+        return item
+    elif not isinstance(item, ParseResults):
+        return Const(item)
 
-def processList(lst):
-    items = [processArg(x) for x in lst[1:]]
+    func = build(item[0])
     args = []
     kwds = {}
 
     # An iterator is used instead of implicit iteration to allow
     # skipping ahead in the keyword argument case.
-    itemitr = iter(items)
+    itemitr = iter(item[1:])
 
-    for item in itemitr:
-        if isinstance(item, KeywordArg):
+    for arg in itemitr:
+        if isinstance(arg, KeywordArg):
             # The next item after the keyword arg marker is its value.
             # This advances the iterator in a way that is compatible
             # with the for loop.
-            val = next(itemitr)
-            key = item.name
-            kwds[key] = val
+            kwds[arg.name] = build(next(itemitr))
         else:
-            args.append(item)
+            args.append(build(arg))
+
+    if isinstance(func, Const) and func.name in ("and", "or") and not kwds:
+        return BoolOp(func, args, kwds)
+    elif isinstance(func, Const) and func.name == "if":
+        if kwds or len(args) not in (2, 3):
+            raise ExpressionError("'if' takes 2 or 3 positional arguments")
+        return IfElse(func, args, kwds)
+    else:
+        return Call(func, args, kwds)
+
+
+def walk(node):
+    """Iterate over the nodes of an expression tree, depth first."""
+    yield node
+    if isinstance(node, Call):
+        for child in itertools.chain([node.func], node.args, node.kwds.values()):
+            yield from walk(child)
+    elif isinstance(node, Shared):
+        yield from walk(node.node)
+
+
+def _format_value(value):
+    if value is None:
+        return "null"
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    elif isinstance(value, str):
+        return '"{}"'.format(value)
+    elif isinstance(value, (int, float)):
+        return repr(value)
+    else:
+        text = repr(value)
+        return text if len(text) <= 40 else text[:36] + "...>"
 
-    func = processArg(lst[0])
 
-    # list and tuple are two builtins that take a single argument,
-    # whereas args is a list. On a KeyError, the call is retried
-    # without arg unpacking.
-    try:
-        return func(*args, **kwds)
-    except TypeError:
-        return func(args, **kwds)
+def unparse(node, labels=None):
+    """Format an expression tree as an expression.
+
+    Shared subexpressions are labeled where they first appear, as in
+    #1=(area g), and referred to as #1# afterwards.
+
+    """
+    if labels is None:
+        labels = {}
+
+    if isinstance(node, Shared):
+        if node in labels:
+            return "#{}#".format(labels[node])
+        labels[node] = len(labels) + 1
+        return "#{}={}".format(labels[node], unparse(node.node, labels))
+    elif isinstance(node, Var):
+        return node.name
+    elif isinstance(node, Const):
+        return node.name or _format_value(node.value)
+    elif isinstance(node, Call):
+        items = [unparse(node.func, labels)]
+        items.extend(unparse(arg, labels) for arg in node.args)
+        for key, val in node.kwds.items():
+            items.extend([":" + key, unparse(val, labels)])
+        return "({})".format(" ".join(items))
+    else:
+        return repr(node)
+
+
+def names(node):
+    """Get the set of variable names used by an expression tree."""
+    return {item.name for item in walk(node) if isinstance(item, Var)}
+
+
+class Expression:
+    """A compiled snuggs expression.
+
+    Expressions are parsed once and may be evaluated any number of
+    times. Variables are bound at evaluation time.
+
+    Attributes
+    ----------
+    source : str
+        Expression source.
+    root : Node
+        The root of the expression tree. Assigning a new or modified
+        tree assigns slots to its variables and shared subexpressions.
+    names : frozenset
+        The names of variables used in the expression.
+
+    """
 
+    def __init__(self, source, root):
+        self.source = source
+        self.root = root
 
-def handleLine(line):
+    @property
+    def root(self):
+        return self._root
+
+    @root.setter
+    def root(self, node):
+        slots = {}
+        for item in walk(node):
+            if isinstance(item, Var):
+                item.index = slots.setdefault(item.name, len(slots))
+        self._names = tuple(slots)
+
+        for item in walk(node):
+            if isinstance(item, Shared):
+                item.index = slots.setdefault(item, len(slots))
+
+        self._size = len(slots)
+        self._root = node
+        self.names = frozenset(self._names)
+
+    def __repr__(self):
+        return "<Expression {!r}>".format(self.source)
+
+    def __call__(self, kwd_dict=None, **kwds):
+        """Evaluate the expression.
+
+        Parameters
+        ----------
+        kwd_dict : dict
+            A dict of items that form the evaluation context. Deprecated.
+        kwds : dict
+            A dict of items that form the evaluation context.
+
+        Returns
+        -------
+        object
+
+        """
+        kwd_dict = kwd_dict or kwds
+        frame = [_missing] * self._size
+        for index, name in enumerate(self._names):
+            if name in kwd_dict:
+                frame[index] = kwd_dict[name]
+
+        token = _ctx.set(frame)
+        try:
+            return self._root.evaluate()
+        finally:
+            _ctx.reset(token)
+
+
+def compile(source):
+    """Compile a snuggs expression.
+
+    Parameters
+    ----------
+    source : str
+        Expression source.
+
+    Returns
+    -------
+    Expression
+
+    Raises
+    ------
+    ExpressionError
+        If the source can not be parsed or refers to an unknown
+        function.
+
+    """
     try:
-        result = expr.parseString(line)
-        return processList(result[0])
+        result = expr.parseString(source)
     except ParseException as exc:
         text = str(exc)
         m = re.search(r"(Expected .+) \(at char (\d+)\), \(line:(\d+)", text)
@@ -271,10 +541,12 @@ def handleLine(line):
         if "map|partial" in msg:
             msg = "expected a function or operator"
         err = ExpressionError(msg)
-        err.text = line
+        err.text = source
         err.offset = int(m.group(2)) + 1
         raise err
 
+    return Expression(source, build(result[0]))
+
 
 def eval(source, kwd_dict=None, **kwds):
     """Evaluate a snuggs expression.
@@ -293,6 +565,4 @@ def eval(source, kwd_dict=None, **kwds):
     object
 
     """
-    kwd_dict = kwd_dict or kwds
-    with ctx(kwd_dict):
-        return handleLine(source)
+    return compile(source)(kwd_dict, **kwds)
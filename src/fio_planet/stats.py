@@ -0,0 +1,163 @@
+# stats.py: counting of calls and time by stage of processing.
+
+"""Collection of processing statistics."""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import sys
+import threading
+from time import perf_counter
+from typing import Callable, Dict, Generator, List, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+
+class Stats:
+    """Counts of calls and time spent by stage of processing.
+
+    Stages are named by strings such as "decode", "shape", and
+    "encode". Pipeline expression functions are counted as stages named
+    for their expression, such as "(area g)".
+
+    Attributes
+    ----------
+    counters : dict
+        Maps stage names to [calls, seconds] lists.
+    start : float
+        perf_counter() value at the creation of the instance.
+
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, List[float]] = {}
+        self.start = perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, calls: int = 1) -> None:
+        """Add calls and time to a stage's counter."""
+        with self._lock:
+            counter = self.counters.setdefault(name, [0, 0.0])
+            counter[0] += calls
+            counter[1] += seconds
+
+    def report(self) -> str:
+        """Format the counters as a table.
+
+        Stages are sorted by total time, descending. The table is
+        followed by a summary of the number of input features, which is
+        the number of calls of the "decode" stage, their rate, and the
+        peak memory use of the process.
+
+        Returns
+        -------
+        str
+
+        """
+        elapsed = perf_counter() - self.start
+        lines = ["{:<40} {:>10} {:>12} {:>12}".format("stage", "calls", "s", "us/call")]
+        for name, (calls, seconds) in sorted(
+            self.counters.items(), key=lambda item: item[1][1], reverse=True
+        ):
+            lines.append(
+                "{:<40} {:>10d} {:>12.6f} {:>12.1f}".format(
+                    name[:40], int(calls), seconds, 1e6 * seconds / calls
+                )
+            )
+
+        features = int(self.counters.get("decode", [0])[0])
+        summary = "features: {}, elapsed: {:.3f} s, features/s: {:.1f}".format(
+            features, elapsed, features / elapsed if elapsed else 0.0
+        )
+        peak = peak_memory()
+        if peak is not None:
+            summary += ", peak memory: {:.1f} MB".format(peak / 2**20)
+        lines.append(summary)
+        return "\n".join(lines)
+
+
+def peak_memory() -> Optional[int]:
+    """Get the peak resident set size of the process in bytes.
+
+    Returns None on platforms without the resource module.
+
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+_stats: ContextVar = ContextVar("stats", default=None)
+
+
+def get_stats() -> Optional[Stats]:
+    """Get the Stats being collected in this context, if any."""
+    return _stats.get()
+
+
+@contextmanager
+def collect_stats(stats: Optional[Stats] = None) -> Generator:
+    """Collect statistics of the processing done within a block.
+
+    Parameters
+    ----------
+    stats : Stats, optional
+        An instance to which counts are added. By default, a new one.
+
+    Yields
+    ------
+    Stats
+
+    Examples
+    --------
+    >>> with collect_stats() as stats:
+    ...     results = list(map_features("area g", features))
+    ...
+    >>> print(stats.report())
+
+    """
+    stats = stats or Stats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function so that its calls are counted as a stage.
+
+    When no statistics are being collected, the function is called
+    directly.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+
+    Returns
+    -------
+    callable
+
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _stats.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add(name, perf_counter() - start)
+
+        return wrapper
+
+    return decorator
@@ -1,23 +1,51 @@
 # Python module tests
 
+from collections import defaultdict
 import json
 
+import numpy as np
 import pytest  # type: ignore
 import shapely  # type: ignore
 from shapely.geometry import LineString, MultiPoint, Point, mapping, shape  # type: ignore
+from shapely.geometry.base import BaseGeometry  # type: ignore
 
 from fio_planet.errors import ReduceError
+from fio_planet.serialize import MappedRecords
+from fio_planet import snuggs
 from fio_planet.features import (  # type: ignore
+    compile_pipeline,
+    explain_pipeline,
+    is_vectorizable,
+    join_features,
+    map_batch,
     map_feature,
+    map_features,
+    fold_constants,
+    order_conditions,
+    prepare_constants,
+    read_features,
+    read_geometry,
     reduce_features,
+    share_subexpressions,
     vertex_count,
     area,
     buffer,
+    chunked_union,
     collect,
+    convex_hull_all,
     distance,
     dump,
+    GeometryStream,
+    get_transformer,
     identity,
     length,
+    mean_area,
+    simplify,
+    total_bounds,
+    total_count,
+    use_projection,
+    utm_crs,
+    zip_feature_properties,
     unary_projectable_property_wrapper,
     unary_projectable_constructive_wrapper,
     binary_projectable_property_wrapper,
@@ -35,6 +63,37 @@ def test_modulate_simple():
     assert (0.0, 0.0) == feat["coordinates"]
 
 
+def test_map_compiled():
+    """A compiled pipeline is evaluated for each feature."""
+    expression = compile_pipeline("upper f")
+    assert ["A", "B"] == [list(map_feature(expression, f))[0] for f in "ab"]
+
+
+def test_map_lazy_geometry():
+    """A feature's geometry is not made unless the pipeline uses it."""
+    feat = {"type": "Feature", "properties": {"a": 1}, "geometry": {"type": "Bogus"}}
+    assert list(map_feature("get (get f 'properties') 'a'", feat)) == [1]
+    with pytest.raises(shapely.errors.GeometryTypeError):
+        list(map_feature("geom_type g", feat))
+
+
+def test_order_conditions():
+    """Conditions on properties are evaluated before geometry predicates."""
+    expression = compile_pipeline(
+        "and (intersects g (Point 4 43)) (== (get (get f 'properties') 'a') 1)"
+    )
+    assert [arg.func.name for arg in expression.root.args] == ["==", "intersects"]
+    feat = {"type": "Feature", "properties": {"a": 0}, "geometry": {"type": "Bogus"}}
+    assert list(map_feature(expression, feat)) == [False]
+
+
+def test_order_conditions_values():
+    """Operands which are not predicates keep their order."""
+    expression = snuggs.compile("(or (buffer g 1) 'none')")
+    order_conditions(expression.root)
+    assert expression.root.args[0].func.name == "buffer"
+
+
 def test_modulate_complex():
     """Exercise a fairly complicated pipeline."""
     bufkwd = "resolution" if shapely.__version__.startswith("1") else "quad_segs"
@@ -155,6 +214,122 @@ def test_reduce_union_geom_type():
     assert "GeometryCollection" == result[0]
 
 
+def test_reduce_multiple_uses():
+    """The collection can be used more than once in a pipeline."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    assert 6 == list(reduce_features("+ (len c) (len c)", data))[0]
+
+
+def test_reduce_no_uses():
+    """Geometries are not made if the pipeline does not use the collection."""
+    features = [{"geometry": {"type": "Bogus"}} for _ in range(3)]
+    assert list(reduce_features("Point 0 0", iter(features)))[0]["type"] == "Point"
+
+
+def test_reduce_zip_properties():
+    """Properties of all features are collected in one pass."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    properties: dict = defaultdict(list)
+    features = zip_feature_properties(iter(data), properties)
+    result = list(reduce_features("Point 0 0", features))
+    assert result[0]["type"] == "Point"
+    assert len(properties["name"]) == 2
+    assert len(properties["aqueduct"]) == 1
+
+
+def test_geometry_stream():
+    """Iteration does not keep geometries."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    stream = GeometryStream(data)
+    assert [geom.geom_type for geom in stream] == ["Point", "LineString", "Polygon"]
+    assert stream._geoms is None
+    with pytest.raises(ReduceError):
+        iter(stream)
+
+
+@pytest.mark.parametrize(
+    ["expression", "expected"],
+    [
+        ("geom_type (collect c)", "GeometryCollection"),
+        ("len (list c)", 3),
+        ("geom_type (unary_union (list c))", "GeometryCollection"),
+    ],
+)
+def test_reduce_list_stream(expression, expected):
+    """A streamed collection can be turned into a list."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    assert list(reduce_features(expression, iter(data))) == [expected]
+
+
+def test_geometry_stream_materialize():
+    """A stream can be turned into a list or array."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    stream = GeometryStream(data)
+    assert len(stream) == 3
+    assert len(np.asarray(stream)) == 3
+    assert len(list(stream)) == 3
+
+
+@pytest.mark.parametrize(
+    ["reducer", "expected"],
+    [
+        ("area (chunked_union c :chunk_size 2)", "area (unary_union c)"),
+        (
+            "area (convex_hull_all c :chunk_size 1)",
+            "area (convex_hull (unary_union c))",
+        ),
+        ("total_bounds c :chunk_size 2", "total_bounds (unary_union c)"),
+        ("total_count c", "len c"),
+    ],
+)
+def test_streaming_reducers(reducer, expected):
+    """Streaming reducers match their materializing equivalents."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    result = list(reduce_features(reducer, iter(data)))
+    assert result == pytest.approx(list(reduce_features(expected, data)))
+
+
+def test_total_area():
+    """Sum and mean of areas are computed in chunks."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    total = list(reduce_features("total_area c :chunk_size 2", data))[0]
+    mean = list(reduce_features("mean_area c", data))[0]
+    assert total == pytest.approx(3 * mean)
+    assert total == pytest.approx(
+        list(reduce_features("area (unary_union c)", data))[0]
+    )
+
+
+def test_reducers_empty():
+    """Streaming reducers handle empty input."""
+    assert chunked_union([]).is_empty
+    assert convex_hull_all([]).is_empty
+    assert all(np.isnan(total_bounds([])))
+    assert total_count([]) == 0
+    assert np.isnan(mean_area([]))
+
+
+def test_total_bounds_empty_geometries():
+    """Chunks of empty geometries do not change the bounds."""
+    assert all(np.isnan(total_bounds(iter([Point()]))))
+    geoms = [Point(), Point(1, 2), Point(), Point(), Point(3, 4)]
+    assert total_bounds(iter(geoms), chunk_size=1) == (1.0, 2.0, 3.0, 4.0)
+
+
 def test_reduce_error():
     """Raise ReduceError when expression doesn't reduce."""
     with open("tests/data/trio.seq") as seq:
@@ -216,6 +391,20 @@ def test_area():
     assert round(qgis_ellipsoidal_area, 4) == round(area(geom) / 1e6, 4)
 
 
+def test_get_transformer():
+    """Transformers are cached."""
+    assert get_transformer("OGC:CRS84", "EPSG:6933") is get_transformer(
+        "OGC:CRS84", "EPSG:6933"
+    )
+
+
+def test_simplify_z():
+    """Projected simplification keeps z coordinates."""
+    geom = simplify(LineString([(0, 0, 1), (0.05, 0, 1), (0.1, 0, 1)]), 10.0)
+    assert geom.has_z
+    assert set(shapely.get_coordinates(geom, include_z=True)[:, 2]) == {1.0}
+
+
 @pytest.mark.parametrize(
     ["kwargs", "exp_distance"],
     [({}, 9648.6280), ({"projected": True}, 9648.6280), ({"projected": False}, 0.1)],
@@ -328,3 +517,345 @@ def test_binary_projectable_property_wrapper(in_xy, exp_xy, kwargs):
     assert round(g1.y, 4) == round(exp_xy[1], 4)
     assert round(g2.x, 4) == round(exp_xy[0], 4)
     assert round(g2.y, 4) == round(exp_xy[1], 4)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_map_features_jobs(ordered):
+    """Features are mapped by a pool of worker processes."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    results = list(
+        map_features("geom_type g", data * 10, jobs=2, ordered=ordered, chunk_size=4)
+    )
+    assert len(results) == 30
+    if ordered:
+        assert [feat for feat, _ in results] == data * 10
+    assert all(
+        values == [shape(feat["geometry"]).geom_type] for feat, values in results
+    )
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_map_features_threads(ordered):
+    """Features are mapped by a pool of threads in the current projection."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    with use_projection("auto-utm"):
+        expected = [list(map_feature("length g", feat)) for feat in data] * 10
+        results = list(
+            map_features(
+                "length g", data * 10, threads=2, ordered=ordered, chunk_size=4
+            )
+        )
+    assert len(results) == 30
+    if ordered:
+        assert [values for _, values in results] == expected
+    else:
+        assert sorted(values for _, values in results) == sorted(expected)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_map_features_jobs_ranges(tmp_path, ordered):
+    """Worker processes read byte ranges of a file."""
+    with open("tests/data/trio.seq") as seq:
+        text = seq.read()
+    path = tmp_path / "test.seq"
+    path.write_text(text * 10)
+
+    results = list(
+        map_features(
+            "geom_type g",
+            MappedRecords(str(path)),
+            jobs=2,
+            ordered=ordered,
+            chunk_size=4,
+        )
+    )
+    assert len(results) == 30
+    if ordered:
+        assert [feat for feat, _ in results] == [
+            json.loads(line) for line in text.splitlines()
+        ] * 10
+    assert all(
+        values == [shape(feat["geometry"]).geom_type] for feat, values in results
+    )
+
+
+def test_map_features_jobs_threads():
+    """Processes and threads can not be combined."""
+    with pytest.raises(ValueError):
+        list(map_features("g", [], jobs=2, threads=2))
+
+
+@pytest.mark.parametrize("expression", ["buffer g 1", "area g", "geom_type g"])
+def test_map_batch_dump_parts(expression):
+    """Parts of a batch give the same values as map_feature()."""
+    data = [
+        {"properties": {}, "geometry": mapping(geom)}
+        for geom in [
+            MultiPoint([(0, 0), (1, 1), (2, 2)]),
+            Point(0, 0),
+            MultiPoint([(4, 4), (5, 5)]),
+        ]
+    ]
+    expected = [
+        [
+            value
+            for part in shapely.get_parts(shape(feat["geometry"]))
+            for value in map_feature(expression, {"geometry": mapping(part)})
+        ]
+        for feat in data
+    ]
+    assert [len(values) for values in expected] == [3, 1, 2]
+    assert map_batch(expression, data, dump_parts=True) == expected
+    assert [
+        list(map_feature(expression, feat, dump_parts=True)) for feat in data
+    ] == expected
+
+
+def test_map_batch_shapely():
+    """Geometries can be kept as Shapely geometries."""
+    data = [
+        {"properties": {}, "geometry": mapping(geom)}
+        for geom in [MultiPoint([(0, 0), (1, 1)]), Point(2, 2)]
+    ]
+    for expression in ["centroid g", "list g (centroid g)"]:
+        values = map_batch(expression, data, dump_parts=True, as_mapping=False)
+        assert all(isinstance(item, BaseGeometry) for item in sum(values, []))
+        assert [[mapping(item) for item in items] for items in values] == map_batch(
+            expression, data, dump_parts=True
+        )
+
+
+@pytest.mark.parametrize(
+    ["expression", "vectorizable"],
+    [
+        ("buffer g 10", True),
+        ("< (area g) 1e6", True),
+        ("intersects g (Point 4 43)", True),
+        ("+ (area g :projected false) (length g :projected false)", True),
+        ("geom_type g", False),
+        ("< (area g) (get (get f 'properties') 'area')", False),
+    ],
+)
+def test_map_batch(expression, vectorizable):
+    """Batch evaluation gives the same values as map_feature()."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    for feat in data:
+        feat["properties"]["area"] = 1e6
+
+    expression = compile_pipeline(expression)
+    assert is_vectorizable(expression.root) == vectorizable
+    assert map_batch(expression, data) == [
+        list(map_feature(expression, feat)) for feat in data
+    ]
+
+
+@pytest.mark.parametrize(
+    ["xy", "crs"],
+    [((4, 43), "EPSG:32631"), ((-105, 40), "EPSG:32613"), ((151, -34), "EPSG:32756")],
+)
+def test_utm_crs(xy, crs):
+    """Find the UTM zone of a geometry."""
+    assert utm_crs(Point(*xy)) == crs
+    assert list(utm_crs(np.array([Point(*xy), Point(*xy)]))) == [crs, crs]
+
+
+def test_utm_crs_empty():
+    """Empty geometries get a zone and measure 0 in it."""
+    assert utm_crs(Point()) == "EPSG:32631"
+    assert list(utm_crs(np.array([Point(), Point(-105, 40)]))) == [
+        "EPSG:32631",
+        "EPSG:32613",
+    ]
+    data = [{"geometry": {"type": "Polygon", "coordinates": []}}]
+    expression = compile_pipeline("area g :crs 'auto-utm'")
+    assert map_batch(expression, data) == [[0.0]]
+    assert list(map_feature(expression, data[0])) == [0.0]
+
+
+@pytest.mark.parametrize("kwargs", [{"crs": "auto-utm"}, {"crs": "EPSG:32631"}])
+def test_distance_crs(kwargs):
+    """Distance is computed in a given projection."""
+    assert round(distance(Point(4, 43), Point(4.1, 43), **kwargs)) == 8152
+
+
+def test_use_projection():
+    """The default projection can be changed."""
+    with use_projection("auto-utm"):
+        assert round(distance(Point(4, 43), Point(4.1, 43))) == 8152
+    assert round(distance(Point(4, 43), Point(4.1, 43))) == 9649
+
+
+def test_buffer_auto_utm_array():
+    """Geometries in different UTM zones are buffered in their zone."""
+    geoms = buffer(np.array([Point(4, 43), Point(-105, 40)]), 100.0, crs="auto-utm")
+    assert [round(val) for val in area(geoms, crs="auto-utm")] == [31214, 31214]
+
+
+def test_func_map_resolution():
+    """Names resolve to registered, builtin, shapely, and method functions."""
+    assert snuggs.func_map["area"] is area
+    assert snuggs.func_map["len"] is len
+    assert snuggs.func_map["unary_union"] is shapely.unary_union
+    assert snuggs.func_map["geom_type"] is snuggs.func_map["geom_type"]
+    assert snuggs.func_map["geom_type"](Point(0, 0)) == "Point"
+    assert snuggs.func_map["equals_exact"](Point(0, 0), Point(0, 0), 0.0)
+
+
+def test_func_map_register():
+    """Functions can be registered for use in expressions."""
+    snuggs.func_map.register("double", lambda x: 2 * x)
+    try:
+        assert snuggs.eval("(double 21)") == 42
+    finally:
+        del snuggs.func_map["double"]
+
+
+def test_fold_constants():
+    """Constant subexpressions are evaluated once."""
+    expression = snuggs.compile("(intersects g (buffer (Point 4 43) 10))")
+    expression.root = fold_constants(expression.root)
+    const = expression.root.args[1]
+    assert isinstance(const, snuggs.Const)
+    assert const.value.geom_type == "Polygon"
+
+
+def test_fold_constants_mutable():
+    """Subexpressions with mutable values are not folded."""
+    expression = snuggs.compile("(list (range 3))")
+    assert fold_constants(expression.root) is expression.root
+    assert expression() is not expression()
+
+
+def test_prepare_constants():
+    """Predicates are rewritten so that constants are prepared."""
+    expression = compile_pipeline("within g (buffer (Point 4 43) 10)")
+    assert expression.root.func.name == "contains"
+    const, var = expression.root.args
+    assert shapely.is_prepared(const.value)
+    assert var.name == "g"
+
+
+def test_prepare_constants_first():
+    """Constants which are first arguments are prepared in place."""
+    geom = shapely.box(0, 0, 1, 1)
+    expression = snuggs.compile("(covers x g)")
+    expression.root.args[0] = snuggs.Const(geom)
+    prepare_constants(expression.root)
+    assert expression.root.func.name == "covers"
+    assert shapely.is_prepared(geom)
+
+
+@pytest.mark.parametrize(
+    ["predicate", "expected"],
+    [("intersects", [True, False, True]), ("disjoint", [False, True, False])],
+)
+def test_prepare_constants_index(predicate, expected):
+    """Constants with many parts are tested using an index."""
+    parts = "MultiPoint (list (zip (range 0 100 5) (range 0 100 5)))"
+    indexed = compile_pipeline(f"{predicate} g (buffer ({parts}) 1 :projected false)")
+    assert indexed.root.func.value is not getattr(shapely, predicate)
+    feats = [
+        {"type": "Feature", "properties": {}, "geometry": mapping(Point(x, x))}
+        for x in (0, 2, 10.5)
+    ]
+    assert [list(map_feature(indexed, feat)) for feat in feats] == [
+        [value] for value in expected
+    ]
+    assert map_batch(indexed, feats) == [[value] for value in expected]
+
+
+def test_read_geometry():
+    """The geometries of a dataset are read and unioned."""
+    geom = read_geometry("tests/data/trio.geojson")
+    assert geom.geom_type == "GeometryCollection"
+    expression = compile_pipeline(
+        "intersects g (read_geometry 'tests/data/trio.geojson')"
+    )
+    feat = {"type": "Feature", "properties": {}, "geometry": mapping(Point(0, 0))}
+    assert list(map_feature(expression, feat)) == [False]
+
+
+@pytest.mark.parametrize(
+    ["bbox", "where", "count"],
+    [
+        (None, None, 3),
+        ((3.86, 43.6, 3.869, 43.62), None, 2),
+        (None, "name IS NOT NULL", 2),
+        ((3.86, 43.6, 3.869, 43.62), "name IS NOT NULL", 1),
+    ],
+)
+def test_read_features(bbox, where, count):
+    """Features of a dataset are filtered by OGR."""
+    features = list(read_features("tests/data/trio.geojson", bbox=bbox, where=where))
+    assert len(features) == count
+    assert all(isinstance(feat["properties"], dict) for feat in features)
+
+
+@pytest.mark.parametrize(["predicate", "count"], [("intersects", 7), ("within", 4)])
+def test_join_features(predicate, count):
+    """Features are joined to the features that satisfy a predicate."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    results = list(join_features(data, data, predicate=predicate, chunk_size=2))
+    assert len(results) == count
+    assert results[0]["geometry"] == data[0]["geometry"]
+    assert results[0]["properties"] == {
+        "name": "Le château d'eau",
+        "name_right": "Le château d'eau",
+    }
+
+
+@pytest.mark.parametrize(["how", "count"], [("inner", 0), ("left", 1)])
+def test_join_features_how(how, count):
+    """Features without matches are kept by a left join."""
+    feat = {"type": "Feature", "properties": {}, "geometry": mapping(Point(0, 0))}
+    other = {"type": "Feature", "properties": {}, "geometry": mapping(Point(1, 1))}
+    assert list(join_features([feat], [other], how=how)) == [feat] * count
+
+
+def test_join_features_predicate():
+    """Unsupported predicates are an error."""
+    with pytest.raises(ValueError):
+        list(join_features([], [], predicate="distance"))
+
+
+def test_share_subexpressions():
+    """Repeated subexpressions are evaluated once per evaluation."""
+    calls = []
+
+    def measure(x):
+        calls.append(x)
+        return x * 2
+
+    snuggs.func_map.register("measure", measure)
+    try:
+        expression = snuggs.compile("(if (> (measure x) 1) (+ (measure x) 1) 0)")
+        expression.root = share_subexpressions(expression.root)
+        assert [expression(x=1), expression(x=0)] == [3, 0]
+        assert calls == [1, 0]
+    finally:
+        del snuggs.func_map["measure"]
+
+
+def test_share_subexpressions_iterators():
+    """Iterators are not reused."""
+    expression = snuggs.compile("(+ (list (range x)) (list (range x)))")
+    expression.root = share_subexpressions(expression.root)
+    assert expression(x=2) == [0, 1, 0, 1]
+
+
+def test_explain_pipeline():
+    """The optimized pipeline is described."""
+    expression = compile_pipeline(
+        "if (< (area g) 1) (buffer g (area g)) (intersects g (Point 0 0))"
+    )
+    assert explain_pipeline(expression) == (
+        "(if (< #1=(area g) 1) (buffer g #1#) (intersects <POINT (0 0)> g))"
+    )
@@ -0,0 +1,436 @@
+# Python module tests
+
+"""Tests of the serialize module."""
+
+import io
+import itertools
+import json
+
+import fiona  # type: ignore
+import numpy as np
+import pytest  # type: ignore
+from shapely.geometry import Point, Polygon, mapping  # type: ignore
+
+from fio_planet.errors import WriteError
+from fio_planet.serialize import (
+    DatasetWriter,
+    MappedRecords,
+    Record,
+    WkbWriter,
+    Writer,
+    get_encoder,
+    infer_schema,
+    is_text_sequence,
+    open_records,
+    read_ahead,
+    read_records,
+    read_stream,
+    read_wkb,
+    round_coordinates,
+)
+
+FEATURE = {
+    "type": "Feature",
+    "id": "0",
+    "properties": {"name": "Le château d'eau", "area": np.float64(1.5)},
+    "geometry": {"type": "Point", "coordinates": (3.8701234567, 43.6109876543)},
+}
+
+
+@pytest.mark.parametrize("backend", ["auto", "orjson", "ujson", "json"])
+def test_encoder(backend):
+    """Encoders write UTF-8 JSON texts."""
+    try:
+        encode = get_encoder(backend)
+    except ValueError:
+        pytest.skip(f"{backend} is not installed")
+
+    obj = json.loads(encode(FEATURE).decode("utf-8"))
+    assert obj["properties"] == {"name": "Le château d'eau", "area": 1.5}
+    assert obj["geometry"]["coordinates"] == [3.8701234567, 43.6109876543]
+
+
+def test_encoder_unknown():
+    """An unknown backend is an error."""
+    with pytest.raises(ValueError):
+        get_encoder("lolwut")
+
+
+def test_round_coordinates():
+    """Coordinates are rounded without modifying the input."""
+    feat = round_coordinates(FEATURE, 3)
+    assert feat["geometry"]["coordinates"] == [3.870, 43.611]
+    assert FEATURE["geometry"]["coordinates"] == (3.8701234567, 43.6109876543)
+
+    collection = {
+        "type": "GeometryCollection",
+        "geometries": [
+            {"type": "LineString", "coordinates": [(0.123, 0.456), (1.0, 1.0)]},
+            {"type": "Polygon", "coordinates": []},
+        ],
+    }
+    assert round_coordinates(collection, 1)["geometries"][0]["coordinates"] == [
+        [0.1, 0.5],
+        [1.0, 1.0],
+    ]
+    assert round_coordinates(42.0, 1) == 42.0
+
+
+@pytest.mark.parametrize(["use_rs", "prefix"], [(False, b""), (True, b"\x1e")])
+def test_writer(use_rs, prefix):
+    """Texts are written in batches."""
+    stream = io.BytesIO()
+    with Writer(stream, use_rs=use_rs, batch_size=2, encoder=get_encoder("json")) as w:
+        for i in range(3):
+            w.write(i)
+            if i == 1:
+                assert stream.getvalue() == prefix + b"0\n" + prefix + b"1\n"
+    assert stream.getvalue() == b"".join(prefix + b"%d\n" % i for i in range(3))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'{"a": 1}\n\n{"b": [2]}\n',
+        b'\x1e{"a": 1}\n\x1e{\n  "b": [2]\n}\n',
+    ],
+)
+def test_read_records(data):
+    """Newline and RS-delimited texts are decoded with their text."""
+    records = list(read_records(io.BytesIO(data)))
+    assert records == [{"a": 1}, {"b": [2]}]
+    assert isinstance(records[0], Record)
+    assert records[0].raw == b'{"a": 1}'
+
+
+def test_read_records_empty():
+    """Empty input yields nothing."""
+    assert list(read_records(io.BytesIO(b"\n"))) == []
+
+
+@pytest.mark.parametrize(
+    ["data", "precision", "expected"],
+    [
+        (b'{"a":  1.25}', None, b'{"a":  1.25}\n'),
+        (b'\x1e{\n"a": 1.25}', None, b'{"a": 1.25}\n'),
+        (b'{"a":  1.25}', 1, b'{"a": 1.25}\n'),
+    ],
+)
+def test_writer_record(data, precision, expected):
+    """Original texts are written when possible."""
+    stream = io.BytesIO()
+    (record,) = read_records(io.BytesIO(data))
+    with Writer(stream, precision=precision, encoder=get_encoder("json")) as w:
+        w.write_record(record)
+    assert stream.getvalue() == expected
+
+
+@pytest.mark.parametrize("precision", [None, 1])
+def test_writer_parts(precision):
+    """Copies of a feature are written with new ids and geometries."""
+    stream = io.BytesIO()
+    feature = {"geometry": None, "id": "a", "properties": {"b": 1.25}}
+    geometries = [{"type": "Point", "coordinates": [i + 0.25, 0.0]} for i in range(2)]
+    with Writer(stream, precision=precision, encoder=get_encoder("json")) as w:
+        w.write_parts(feature, geometries)
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == [
+        {
+            "geometry": round_coordinates(geom, precision) if precision else geom,
+            "id": f"a:{i}",
+            "properties": {"b": 1.25},
+        }
+        for i, geom in enumerate(geometries)
+    ]
+
+
+@pytest.mark.parametrize("precision", [None, 1])
+def test_writer_shapely(precision):
+    """Shapely geometries are written like their mappings."""
+    geometries = [
+        Point(0.25, 1.5),
+        Point(0.25, 1.5, 2.75),
+        Polygon(),
+        Polygon([(0, 0), (1.25, 0), (1.25, 1.25), (0, 0)]),
+    ]
+    feature = {"type": "Feature", "geometry": None, "id": "a", "properties": {}}
+    stream = io.BytesIO()
+    with Writer(stream, precision=precision, batch_size=3) as w:
+        for geom in geometries:
+            w.write(geom)
+            w.write({**feature, "geometry": geom})
+        w.write_parts(feature, geometries)
+
+    texts = stream.getvalue().splitlines()
+    expected = json.loads(
+        json.dumps(
+            [
+                (
+                    round_coordinates(mapping(geom), precision)
+                    if precision
+                    else mapping(geom)
+                )
+                for geom in geometries
+            ]
+        )
+    )
+    assert [json.loads(text) for text in texts[:8:2]] == expected
+    assert [json.loads(text)["geometry"] for text in texts[1:8:2]] == expected
+    assert [json.loads(text)["geometry"] for text in texts[8:]] == expected
+    # Members keep their order.
+    assert list(json.loads(texts[1])) == ["type", "geometry", "id", "properties"]
+    assert list(json.loads(texts[8])) == ["type", "geometry", "id", "properties"]
+
+
+@pytest.mark.parametrize("size", [1, 100])
+def test_read_ahead(size):
+    """Items are read by a thread, in order."""
+    assert list(read_ahead(iter(range(10)), size)) == list(range(10))
+
+
+def test_read_ahead_error():
+    """Errors of the iterable are raised by the consumer."""
+
+    def items():
+        yield 1
+        raise ValueError("bad input")
+
+    reader = read_ahead(items(), 1)
+    assert next(reader) == 1
+    with pytest.raises(ValueError, match="bad input"):
+        next(reader)
+
+
+def test_read_ahead_close():
+    """A consumer can stop before the end of the items."""
+    reader = read_ahead(itertools.count(), 2)
+    assert next(reader) == 0
+    reader.close()
+
+
+@pytest.mark.parametrize("use_rs", [False, True])
+def test_writer_queue(use_rs):
+    """Batches are written by a thread before the writer closes."""
+    stream = io.BytesIO()
+    prefix = b"\x1e" if use_rs else b""
+    with Writer(
+        stream, use_rs=use_rs, batch_size=2, queue_size=1, encoder=get_encoder("json")
+    ) as w:
+        for i in range(5):
+            w.write(i)
+    assert stream.getvalue() == b"".join(prefix + b"%d\n" % i for i in range(5))
+
+
+def test_writer_queue_error():
+    """Errors of the writer thread are raised when the writer closes."""
+
+    class Closed(io.BytesIO):
+        def write(self, data):
+            raise BrokenPipeError()
+
+    with pytest.raises(BrokenPipeError):
+        with Writer(Closed(), queue_size=1, encoder=get_encoder("json")) as w:
+            w.write(0)
+
+
+def test_infer_schema():
+    """Field types are inferred from property values."""
+    features = [
+        {"geometry": {"type": "Point"}, "properties": {"a": 1, "b": 1, "c": None}},
+        {"geometry": None, "properties": {"a": 2, "b": 1.5, "d": [1]}},
+    ]
+    assert infer_schema(features) == {
+        "geometry": "Point",
+        "properties": {"a": "int", "b": "float", "c": "str", "d": "str"},
+    }
+    features.append({"geometry": {"type": "LineString"}, "properties": {}})
+    assert infer_schema(features)["geometry"] == "Unknown"
+
+
+@pytest.mark.parametrize("schema", [None, {"geometry": "Point", "properties": {}}])
+def test_dataset_writer(tmp_path, schema):
+    """Features are written to a dataset in batches."""
+    if schema:
+        schema["properties"] = {"name": "str", "area": "float"}
+    path = str(tmp_path / "test.gpkg")
+    with DatasetWriter(path, schema=schema, precision=1, batch_size=2) as w:
+        for i in range(3):
+            w.write(FEATURE)
+        w.write_parts(FEATURE, [{"type": "Point", "coordinates": (1.25, 1.0)}])
+
+    with fiona.open(path) as src:
+        assert src.schema["properties"] == {"name": "str", "area": "float"}
+        features = list(src)
+    assert len(features) == 4
+    assert features[0].properties["name"] == "Le château d'eau"
+    assert features[0].geometry.coordinates == (3.9, 43.6)
+
+
+def test_dataset_writer_extra(tmp_path):
+    """Properties must be in the schema."""
+    schema = {"geometry": "Point", "properties": {"name": "str"}}
+    with pytest.raises(WriteError, match="area"):
+        with DatasetWriter(str(tmp_path / "test.gpkg"), schema=schema) as w:
+            w.write(FEATURE)
+
+
+@pytest.mark.parametrize(
+    ["feature", "match"],
+    [
+        ({**FEATURE, "properties": {"other": 1}}, "other"),
+        ({**FEATURE, "geometry": 1.5}, "float"),
+    ],
+)
+def test_dataset_writer_error(tmp_path, feature, match):
+    """A partly written dataset is removed."""
+    path = tmp_path / "test.gpkg"
+    w = DatasetWriter(str(path), batch_size=1)
+    w.write(FEATURE)
+    assert path.exists()
+    with pytest.raises(WriteError, match=match):
+        w.write(feature)
+    w.close()
+    assert not path.exists()
+
+
+@pytest.mark.parametrize("precision", [None, 1])
+def test_wkb_writer(precision):
+    """Features are written to and read from a binary stream."""
+    stream = io.BytesIO()
+    with WkbWriter(stream, precision=precision, batch_size=2) as w:
+        w.write(FEATURE)
+        w.write({**FEATURE, "geometry": None})
+        w.write_parts(FEATURE, [Point(0, 1), {"type": "Point", "coordinates": (1, 2)}])
+
+    stream.seek(0)
+    features = list(read_wkb(stream, batch_size=3))
+    assert len(features) == 4
+    assert features[0]["properties"] == {"name": "Le château d'eau", "area": 1.5}
+    assert features[0]["geometry"].equals(
+        Point(3.9, 43.6) if precision else Point(3.8701234567, 43.6109876543)
+    )
+    assert features[1]["geometry"] is None
+    assert [feat["id"] for feat in features[2:]] == ["0:0", "0:1"]
+    assert features[3]["geometry"] == Point(1, 2)
+
+
+def test_wkb_writer_error():
+    """Only geometries can be written as WKB."""
+    with pytest.raises(WriteError, match="float"):
+        with WkbWriter(io.BytesIO()) as w:
+            w.write_parts(FEATURE, [1.5])
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_read_stream(binary):
+    """Binary and text streams are recognized."""
+    stream = io.BytesIO()
+    with WkbWriter(stream) if binary else Writer(stream) as w:
+        w.write(FEATURE)
+    stream.seek(0)
+    (feat,) = read_stream(stream)
+    assert feat["id"] == "0"
+    assert isinstance(feat["geometry"], Point) == binary
+
+
+def test_read_wkb_invalid():
+    """Invalid and truncated streams are errors."""
+    with pytest.raises(ValueError, match="Not a binary"):
+        list(read_wkb(io.BytesIO(b'{"a": 1}\n')))
+
+    stream = io.BytesIO()
+    with WkbWriter(stream) as w:
+        w.write(FEATURE)
+    with pytest.raises(ValueError, match="truncated"):
+        list(read_wkb(io.BytesIO(stream.getvalue()[:-30])))
+
+
+@pytest.mark.parametrize("use_rs", [False, True])
+def test_mapped_records(tmp_path, use_rs):
+    """Texts of a file are read in byte ranges."""
+    path = str(tmp_path / "test.seq")
+    with open(path, "wb") as f:
+        with Writer(f, use_rs=use_rs, encoder=get_encoder("json")) as w:
+            for i in range(10):
+                w.write({"a": i})
+
+    records = MappedRecords(path)
+    assert [rec["a"] for rec in records] == list(range(10))
+    assert isinstance(next(iter(records)), Record)
+    ranges = list(records.ranges(3))
+    assert len(ranges) == 4
+    assert [[rec["a"] for rec in records.read(*r)] for r in ranges] == [
+        [0, 1, 2],
+        [3, 4, 5],
+        [6, 7, 8],
+        [9],
+    ]
+    # Texts belong to the range in which they begin.
+    assert [rec["a"] for rec in records.read(1, 11)] == [1]
+
+
+@pytest.mark.parametrize(
+    ["data", "use_rs"],
+    [
+        (b'\n \x1e{"a": 0}\n\x1e{"a": 1}\n', True),
+        (b'{"a": 0}\n{"a": 1}\n', False),
+    ],
+)
+def test_mapped_records_framing(tmp_path, data, use_rs):
+    """Framing is found from the first non-whitespace byte."""
+    path = tmp_path / "test.seq"
+    path.write_bytes(data)
+    records = MappedRecords(str(path))
+    assert records._rs == use_rs
+    assert [rec["a"] for rec in records] == [0, 1]
+
+
+def test_mapped_records_multiline(tmp_path):
+    """RS-delimited texts may span lines."""
+    path = tmp_path / "test.seq"
+    path.write_bytes(b'\n\x1e{\n"a": 1}\n\x1e{"b": 2}\n')
+    assert list(MappedRecords(str(path))) == [{"a": 1}, {"b": 2}]
+
+
+def test_mapped_records_empty(tmp_path):
+    """An empty file has no texts."""
+    path = tmp_path / "test.seq"
+    path.write_bytes(b"")
+    assert list(MappedRecords(str(path))) == []
+    assert list(MappedRecords(str(path)).ranges(2)) == []
+
+
+def test_is_text_sequence():
+    """Sequences of GeoJSON features are recognized."""
+    assert is_text_sequence("tests/data/trio.seq")
+    assert not is_text_sequence("tests/data/trio.geojson")
+    assert not is_text_sequence("zip+https://example.com/test.zip")
+
+
+def test_is_text_sequence_long_line(tmp_path):
+    """Files with a long first line are recognized from their beginning."""
+    feature = {**FEATURE, "properties": {"name": "x" * 100000}}
+    path = tmp_path / "test.seq"
+    path.write_text(json.dumps(feature))
+    assert is_text_sequence(str(path))
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": [feature]}))
+    assert not is_text_sequence(str(path))
+    assert not is_text_sequence("tests/data/rmnp.geojson")
+
+
+def test_open_records(tmp_path):
+    """Regular files are mapped and other streams are read."""
+    with open("tests/data/trio.seq", "rb") as f:
+        assert isinstance(open_records(f), MappedRecords)
+        assert len(list(open_records(f))) == 3
+
+    path = tmp_path / "test.wkb"
+    with open(path, "wb") as f:
+        with WkbWriter(f) as w:
+            w.write(FEATURE)
+    with open(path, "rb") as f:
+        assert not isinstance(open_records(f), MappedRecords)
+        assert len(list(open_records(f))) == 1
+
+    with open("tests/data/trio.seq", "rb") as f:
+        stream = io.BytesIO(f.read())
+    assert len(list(open_records(stream))) == 3
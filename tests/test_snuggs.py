@@ -2,6 +2,9 @@
 
 """Tests of the snuggs module."""
 
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
 import pytest  # type: ignore
 
 from fio_planet import snuggs
@@ -23,3 +26,107 @@ def test_truth(arg):
 def test_not(arg):
     """Expression is true."""
     assert snuggs.eval(f"(not {arg})")
+
+
+def test_compile_reuse():
+    """A compiled expression can be evaluated with different bindings."""
+    expression = snuggs.compile("(+ x 1)")
+    assert expression.names == {"x"}
+    assert [expression(x=i) for i in range(3)] == [1, 2, 3]
+
+
+def test_compile_unbound_name():
+    """Names are resolved at evaluation time, not compile time."""
+    expression = snuggs.compile("(+ x 1)")
+    with pytest.raises(snuggs.ExpressionError):
+        expression(y=1)
+
+
+@pytest.mark.parametrize(
+    ["source", "expected"],
+    [
+        ("(and 1 2)", 2),
+        ("(and 1 0 x)", 0),
+        ("(or 0 '' 3 x)", 3),
+        ("(or 0 false)", False),
+    ],
+)
+def test_and_or(source, expected):
+    """and and or stop evaluating once the result is known."""
+    assert snuggs.eval(source) == expected
+
+
+def test_word_operator_prefix():
+    """Functions may have names that begin with an operator's name."""
+    func_map = snuggs.func_map
+    snuggs.func_map = {"is_odd": lambda x: x % 2 == 1}
+    try:
+        assert snuggs.eval("(is_odd 3)")
+    finally:
+        snuggs.func_map = func_map
+
+
+def test_lazy():
+    """Lazy values are computed once, when first used."""
+    calls = []
+
+    def func():
+        calls.append(1)
+        return 2
+
+    expression = snuggs.compile("(and x (+ y y))")
+    assert expression(x=0, y=snuggs.Lazy(func)) == 0
+    assert not calls
+    assert expression(x=1, y=snuggs.Lazy(func)) == 4
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize(["x", "expected"], [(2, "big"), (0, "small")])
+def test_if(x, expected):
+    """Only one branch of an if expression is evaluated."""
+    assert snuggs.eval('(if (> x 1) "big" (if y "?" "small"))', x=x, y=0) == expected
+    assert snuggs.eval('(if (> x 1) "big")', x=0) is None
+
+
+def test_if_arguments():
+    """if takes two or three arguments."""
+    with pytest.raises(snuggs.ExpressionError):
+        snuggs.compile("(if 1 2 3 4)")
+
+
+def test_unparse():
+    """Expression trees are formatted as expressions."""
+    source = '(== (+ x 1 2.5) "a" null true)'
+    assert snuggs.unparse(snuggs.compile(source).root) == source
+
+
+def test_threads():
+    """Threads evaluate expressions in their own contexts."""
+    barrier = threading.Barrier(2)
+
+    def wait(x):
+        barrier.wait(timeout=5)
+        return x
+
+    func_map = snuggs.func_map
+    snuggs.func_map = {"wait": wait}
+    try:
+        expression = snuggs.compile("(+ (wait x) x)")
+    finally:
+        snuggs.func_map = func_map
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda i: expression(x=i), [1, 10]))
+    assert results == [2, 20]
+
+
+def test_reentrant():
+    """An expression may be evaluated while it is being evaluated."""
+    expression = snuggs.compile("(+ (y x) x)")
+    expression.root.args[0].func = snuggs.Var("y", "", 0)
+    expression.root = expression.root
+
+    def y(x):
+        return expression(x=x + 1, y=lambda x: 0) if x < 2 else 0
+
+    assert expression(x=1, y=y) == 3
@@ -0,0 +1,60 @@
+# Python module tests
+
+"""Tests of the stats module."""
+
+import json
+
+from fio_planet.features import compile_pipeline, map_features
+from fio_planet.stats import Stats, collect_stats, get_stats, timed
+
+
+def test_stats_report():
+    """Counters are reported by total time."""
+    stats = Stats()
+    stats.add("decode", 0.5)
+    stats.add("decode", 0.25)
+    stats.add("shape", 1.0, calls=3)
+    assert stats.counters == {"decode": [2, 0.75], "shape": [3, 1.0]}
+
+    lines = stats.report().splitlines()
+    assert lines[0].split() == ["stage", "calls", "s", "us/call"]
+    assert lines[1].split()[:2] == ["shape", "3"]
+    assert lines[2].split()[:2] == ["decode", "2"]
+    assert lines[3].startswith("features: 2,")
+
+
+def test_collect_stats():
+    """Timed functions are counted only while stats are collected."""
+
+    @timed("double")
+    def double(x):
+        return 2 * x
+
+    assert get_stats() is None
+    assert double(1) == 2
+
+    with collect_stats() as stats:
+        assert get_stats() is stats
+        double(1)
+        double(2)
+
+    assert get_stats() is None
+    double(3)
+    assert stats.counters["double"][0] == 2
+
+
+def test_collect_stats_pipeline():
+    """Stages and pipeline functions are counted."""
+    with open("tests/data/trio.seq") as seq:
+        data = [json.loads(line) for line in seq.readlines()]
+
+    with collect_stats() as stats:
+        expression = compile_pipeline("centroid (buffer g 10)")
+        results = list(map_features(expression, data, threads=2, chunk_size=1))
+
+    assert len(results) == 3
+    assert stats.counters["shape"][0] == 3
+    assert stats.counters["mapping"][0] == 3
+    assert stats.counters["(buffer g 10)"][0] == 3
+    assert stats.counters["(centroid (buffer g 10))"][0] == 3
+    assert stats.counters["transform"][0] == 6